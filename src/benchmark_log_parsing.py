@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from phasediagram import hmc_log_scanner
+from plaquette import flow_log_scanner, read_plaquette_from_flows
+
+
+def get_args():
+    parser = ArgumentParser(
+        description=(
+            "Compare line-by-line parsing of HMC and flow logs "
+            "with the bulk scanners in logscan.py, on synthetic logs."
+        )
+    )
+    parser.add_argument("--size_mb", type=float, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tmpdir", default=None)
+    return parser.parse_args()
+
+
+def write_hmc_log(f, size, rng):
+    f.write(b"[MD_INT][10]MD parameters: level=0 tlen=1.000000 nsteps=10\n")
+    # HMC logs are dominated by untagged lines
+    padding = b"".join(
+        b"[FORCE][10]Force%d: avg |force| = 1.2345678901 max |force| = 2.3456\n" % i
+        for i in range(40)
+    )
+    trajectory = 0
+    while f.tell() < size:
+        trajectory += 1
+        f.write(b"[MAIN][0]Trajectory #%d...\n" % trajectory)
+        f.write(padding)
+        accepted = b"accepted." if rng.random() < 0.8 else b"rejected."
+        f.write(b"[HMC][10]Configuration %s [deltaH = 0.1]\n" % accepted)
+        f.write(b"[MAIN][0]Plaquette: %.16f\n" % rng.random())
+
+
+def write_flow_log(f, size, rng):
+    padding = b"".join(
+        b"[WILSONFLOW][0]WF (t,E,t2*E,Esym,t2*Esym,TC) = %d 1.23 2.34 3.45 4.56 0.1\n"
+        % i
+        for i in range(400)
+    )
+    configuration = 0
+    while f.tell() < size:
+        configuration += 1
+        f.write(
+            b"[IO][0]Configuration [../confs/run1_8x8x8x8nc2b2.0m-1.0n%d] "
+            b"read [0 sec] Plaquette=%.16f\n" % (configuration, rng.random())
+        )
+        f.write(padding)
+
+
+def read_hmc_lines(filename):
+    tlen = None
+    nsteps = None
+    trajectories = []
+    plaquettes = []
+    accepts = []
+    with open(filename, "r") as f:
+        for line in f:
+            if line.startswith("[MD_INT][10]MD parameters:"):
+                tlen = float(line.split()[3].split("=")[1])
+                nsteps = int(line.split()[4].split("=")[1])
+            elif line.startswith("[MAIN][0]Trajectory #"):
+                trajectory = int(line.split()[1].strip("#:."))
+            elif line.startswith("[MAIN][0]Plaquette:"):
+                trajectories.append(trajectory)
+                plaquettes.append(float(line.split()[1]))
+            elif line.startswith("[HMC][10]Configuration"):
+                accepts.append(1 if line.split()[1] == "accepted." else 0)
+    return tlen, nsteps, trajectories, plaquettes, accepts
+
+
+def read_hmc_bulk(filename):
+    records, _ = hmc_log_scanner.scan(filename)
+    trajectory_index = records["trajectory"]["index"]
+    plaquette_index = records["plaquette"]["index"]
+    return (
+        records["md_parameters"]["tlen"][-1],
+        records["md_parameters"]["nsteps"][-1],
+        records["trajectory"]["trajectory"][
+            np.searchsorted(trajectory_index, plaquette_index) - 1
+        ],
+        records["plaquette"]["plaquette"],
+        (records["accept"]["accepted"] == b"accepted.").astype(int),
+    )
+
+
+def read_flow_lines(filename):
+    indices = {}
+    plaquettes = {}
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.startswith("[IO][0]Configuration"):
+                continue
+            split_line = line.split()
+            cfg_filename = split_line[1].strip("[]")
+            run_name = cfg_filename.split("/")[-1].split("_")[0]
+            indices.setdefault(run_name, []).append(int(cfg_filename.split("n")[-1]))
+            plaquettes.setdefault(run_name, []).append(
+                float(split_line[5].split("=")[-1])
+            )
+    return indices, plaquettes
+
+
+def read_flow_bulk(filename):
+    records, _ = flow_log_scanner.scan(filename)
+    return records["configuration"]
+
+
+def check_hmc(lines, bulk):
+    assert lines[:2] == tuple(bulk[:2])
+    for line_values, bulk_values in zip(lines[2:], bulk[2:]):
+        assert np.array_equal(line_values, bulk_values)
+
+
+def check_flow(lines, bulk):
+    indices, plaquettes = lines
+    for run_name in indices:
+        mask = bulk["run_name"] == run_name.encode()
+        assert np.array_equal(indices[run_name], bulk["cfg_index"][mask])
+        assert np.array_equal(plaquettes[run_name], bulk["plaquette"][mask])
+
+
+def best_time(func, filename, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(filename)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    args = get_args()
+    rng = np.random.default_rng(1234)
+    size = int(args.size_mb * 2**20)
+
+    # Each case may also time a step added to ingestion of such logs
+    cases = [
+        ("HMC log", write_hmc_log, read_hmc_lines, read_hmc_bulk, check_hmc, None),
+        (
+            "Flow log",
+            write_flow_log,
+            read_flow_lines,
+            read_flow_bulk,
+            check_flow,
+            ("plaquette", read_plaquette_from_flows),
+        ),
+    ]
+    for name, write, read_lines, read_bulk, check, ingestion in cases:
+        with tempfile.NamedTemporaryFile(dir=args.tmpdir, suffix=".log") as f:
+            write(f, size, rng)
+            f.flush()
+            size_mb = os.path.getsize(f.name) / 2**20
+
+            lines_time, lines_result = best_time(read_lines, f.name, args.repeats)
+            bulk_time, bulk_result = best_time(read_bulk, f.name, args.repeats)
+            check(lines_result, bulk_result)
+            if ingestion is not None:
+                ingestion_name, ingest = ingestion
+                ingestion_time, _ = best_time(ingest, f.name, args.repeats)
+
+        print(
+            f"{name} ({size_mb:.0f} MB): "
+            f"line by line {lines_time:.2f} s ({size_mb / lines_time:.0f} MB/s), "
+            f"bulk {bulk_time:.2f} s ({size_mb / bulk_time:.0f} MB/s), "
+            f"speedup {lines_time / bulk_time:.1f}x"
+        )
+        if ingestion is not None:
+            # Relative to the line-by-line pass that reading the log already makes
+            print(
+                f"  Reading the {ingestion_name} at ingestion: "
+                f"{ingestion_time:.2f} s, {ingestion_time / lines_time:.0%} "
+                "of a line-by-line pass"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import atexit
+import contextlib
+import fcntl
+import functools
+import hashlib
+import inspect
+import os
+import sys
+import tempfile
+
+import joblib
+from joblib.disk import memstr_to_bytes
+
+
+def format_bytes(num_bytes):
+    for unit in "B", "KB", "MB", "GB":
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def hash_file(filename, chunk_size=2**24):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_identity(filename, hash_contents=False):
+    """
+    Summarise the state of a file on disk, so that cache entries computed
+    from an older version of the file are not reused.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    identity = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if hash_contents and os.path.isfile(filename):
+        identity["sha256"] = hash_file(filename)
+    return identity
+
+
+class Cache:
+    """
+    On-disk memoisation of functions whose arguments include filenames.
+
+    Entries are keyed on the function's source, its arguments,
+    and the identity (size, modification time, and optionally content hash)
+    of any files named in the arguments listed in `file_args`.
+    If `bytes_limit` is set,
+    the least recently used entries are removed once it is exceeded.
+
+    The cache may be shared between concurrent processes,
+    including on different nodes using a shared filesystem
+    that supports POSIX (fcntl) record locks, as NFS does with lockd.
+    Locks are held per process, not per thread.
+    Each entry is computed by only one process while holding a lock on it,
+    and is published atomically;
+    other processes wanting the same entry wait for the lock and then reuse it.
+    """
+
+    suffix = ".joblib"
+    # Fraction of bytes_limit that may be written before the cache is trimmed;
+    # trimming walks the whole cache, so is not done after every write
+    eviction_slack = 0.1
+
+    def __init__(self, location="cache", bytes_limit=None, hash_contents=False):
+        self.location = location
+        if isinstance(bytes_limit, str):
+            bytes_limit = memstr_to_bytes(bytes_limit)
+        self.bytes_limit = bytes_limit
+        self.hash_contents = hash_contents
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_read": 0,
+            "bytes_written": 0,
+            "bytes_evicted": 0,
+        }
+        self._bytes_since_reduce = 0
+
+    @classmethod
+    def from_environment(cls):
+        return cls(
+            location=os.environ.get("SU2PV_CACHE_DIR") or "cache",
+            bytes_limit=os.environ.get("SU2PV_CACHE_BYTES_LIMIT") or None,
+            hash_contents=bool(os.environ.get("SU2PV_CACHE_HASH_CONTENTS")),
+        )
+
+    def _identities(self, value):
+        if isinstance(value, (str, os.PathLike)):
+            return file_identity(value, hash_contents=self.hash_contents)
+        if value is None:
+            return None
+        return [self._identities(element) for element in value]
+
+    def cache(self, func=None, *, file_args=("filename", "filenames"), keep_last=False):
+        """
+        Decorate `func` to cache its results.
+        If `keep_last` is set, the most recent result is also held in memory,
+        so that consecutive calls with the same arguments
+        do not need to reload it from disk.
+        """
+        if func is None:
+            return functools.partial(
+                self.cache, file_args=file_args, keep_last=keep_last
+            )
+
+        signature = inspect.signature(func)
+        func_dir = os.path.join(self.location, f"{func.__module__}.{func.__qualname__}")
+        source_hash = joblib.hash(inspect.getsource(func))
+        last = {}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            identities = {
+                name: self._identities(arguments.arguments[name])
+                for name in file_args
+                if name in arguments.arguments
+            }
+            key = joblib.hash([source_hash, arguments.arguments, identities])
+            path = os.path.join(func_dir, key + self.suffix)
+
+            if key in last:
+                self.stats["hits"] += 1
+                return last[key]
+
+            result = self._get_or_compute(path, func, args, kwargs)
+            if keep_last:
+                last.clear()
+                last[key] = result
+            return result
+
+        return wrapper
+
+    def _get_or_compute(self, path, func, args, kwargs):
+        try:
+            return self._load(path)
+        except FileNotFoundError:
+            pass
+
+        with self._lock(path):
+            # Another process may have computed the entry while we waited
+            try:
+                return self._load(path)
+            except FileNotFoundError:
+                pass
+
+            self.stats["misses"] += 1
+            result = func(*args, **kwargs)
+            self._store(path, result)
+        return result
+
+    @contextlib.contextmanager
+    def _lock(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # POSIX record locks, unlike flock, are honoured across NFS clients
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, path):
+        result = joblib.load(path)
+        # Update the modification time to track recency of use for eviction
+        os.utime(path)
+        self.stats["hits"] += 1
+        self.stats["bytes_read"] += os.path.getsize(path)
+        return result
+
+    def _store(self, path, result):
+        self._write(path, result)
+        size = os.path.getsize(path)
+        self.stats["bytes_written"] += size
+        if self.bytes_limit is None:
+            return
+        self._bytes_since_reduce += size
+        if self._bytes_since_reduce > self.eviction_slack * self.bytes_limit:
+            self.reduce_size()
+
+    def _write(self, path, result):
+        # Write to a temporary file and rename,
+        # so that other processes never see a partially-written entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                joblib.dump(result, f)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def _state_path(self, namespace, name):
+        return os.path.join(
+            self.location, "state", namespace, joblib.hash(name) + self.suffix
+        )
+
+    def load_state(self, namespace, name):
+        """
+        Return the state last saved with save_state for `name`, or None.
+        Unlike cached results, this is not tied to the identity of any files;
+        it is for callers that check for themselves whether it is still valid.
+        """
+        try:
+            return joblib.load(self._state_path(namespace, name))
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, namespace, name, state):
+        self._store(self._state_path(namespace, name), state)
+
+    def entries(self):
+        """
+        Return (modification time, size, path) for each entry,
+        least recently used first.
+        """
+        result = []
+        for dirpath, _, filenames in os.walk(self.location):
+            for filename in filenames:
+                if not filename.endswith(self.suffix):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                result.append((stat.st_mtime, stat.st_size, path))
+        return sorted(result)
+
+    def reduce_size(self, bytes_limit=None):
+        if bytes_limit is None:
+            bytes_limit = self.bytes_limit
+        self._bytes_since_reduce = 0
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= bytes_limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total_size -= size
+            self.stats["bytes_evicted"] += size
+            # A process waiting on this lock will still compute the entry;
+            # at worst, one created afterwards computes it concurrently,
+            # and the atomic rename keeps either result intact
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + ".lock")
+
+    def reduce_pending(self):
+        """
+        Trim the cache if anything has been written since it was last trimmed.
+        """
+        if self.bytes_limit is not None and self._bytes_since_reduce:
+            self.reduce_size()
+
+    def format_stats(self):
+        return (
+            f"Cache {self.location}: "
+            f"{self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{format_bytes(self.stats['bytes_read'])} read, "
+            f"{format_bytes(self.stats['bytes_written'])} written, "
+            f"{format_bytes(self.stats['bytes_evicted'])} evicted"
+        )
+
+    def report(self):
+        print(self.format_stats(), file=sys.stderr)
+
+
+memory = Cache.from_environment()
+if os.environ.get("SU2PV_CACHE_STATS"):
+    atexit.register(memory.report)
+# Registered last so that it runs first, and evictions are reported
+atexit.register(memory.reduce_pending)
+
+
+def get_args():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Inspect or trim the analysis cache.")
+    parser.add_argument("--reduce_size", default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.reduce_size is not None:
+        memory.reduce_size(memstr_to_bytes(args.reduce_size))
+
+    sizes = {}
+    for _, size, path in memory.entries():
+        function = os.path.basename(os.path.dirname(path))
+        count, total = sizes.get(function, (0, 0))
+        sizes[function] = count + 1, total + size
+
+    for function, (count, total) in sorted(sizes.items()):
+        print(f"{function}: {count} entries, {format_bytes(total)}")
+    print(f"Total: {format_bytes(sum(total for _, total in sizes.values()))}")
+
+
+if __name__ == "__main__":
+    main()
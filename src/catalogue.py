@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+
+from cache import file_identity
+from flow_store import _to_json
+
+# Description keys that results are indexed by, and their column types;
+# L is taken from NX where results describe a single volume
+indexed_keys = {
+    "Npv": "INTEGER",
+    "mpv": "REAL",
+    "beta": "REAL",
+    "L": "INTEGER",
+    "time": "REAL",
+    "operator": "TEXT",
+}
+
+
+class Catalogue:
+    """
+    A local SQLite index of the results written by each stage,
+    with the value and error of each Obs they contain,
+    so that they can be found by their parameters
+    without reconstructing filenames or loading every file.
+    collate_critical_mf reads the critical masses from it;
+    other stages read their inputs from the files themselves.
+
+    Many processes may register results at once;
+    writers wait up to `timeout` seconds for each other.
+    The default rollback journal is used rather than write-ahead logging,
+    which needs shared memory that network filesystems don't provide.
+    """
+
+    def __init__(self, filename, timeout=60):
+        self.filename = filename
+        self.timeout = timeout
+        with self._connect() as connection:
+            columns = ", ".join(
+                f"{key} {column_type}" for key, column_type in indexed_keys.items()
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                f"(filename TEXT PRIMARY KEY, stage TEXT NOT NULL, {columns}, "
+                "description TEXT, observables TEXT, identity TEXT)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_by_parameters ON results "
+                f"(stage, {', '.join(indexed_keys)})"
+            )
+
+    @classmethod
+    def from_environment(cls):
+        filename = os.environ.get("SU2PV_CATALOGUE")
+        return cls(filename) if filename else None
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # One transaction per connection, committed if no exception is raised
+        if os.path.dirname(self.filename):
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with contextlib.closing(
+            sqlite3.connect(self.filename, timeout=self.timeout)
+        ) as connection:
+            connection.row_factory = sqlite3.Row
+            with connection:
+                yield connection
+
+    def register(self, filename, stage, description, observables=()):
+        """
+        Record that filename holds results of stage described by description,
+        summarised by observables as in results.load_summary,
+        replacing any earlier record of it.
+        """
+        if not isinstance(description, dict):
+            description = {}
+        values = {key: description.get(key) for key in indexed_keys}
+        if values["L"] is None:
+            values["L"] = description.get("NX")
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results "
+                f"(filename, stage, {', '.join(indexed_keys)}, "
+                "description, observables, identity) "
+                f"VALUES ({', '.join(['?'] * (len(indexed_keys) + 5))})",
+                [
+                    os.path.normpath(filename),
+                    stage,
+                    *values.values(),
+                    json.dumps(description, default=_to_json),
+                    json.dumps(list(observables)),
+                    json.dumps(file_identity(filename)),
+                ],
+            )
+
+    def find(self, stage, order_by=(), filenames=None, **criteria):
+        """
+        Return the records of the results of stage
+        whose indexed parameters equal those given in criteria,
+        ordered by the keys in order_by,
+        and if filenames is given, held in one of filenames.
+        Results whose files have since been removed or rewritten
+        without being registered again are skipped.
+        """
+        for key in [*criteria, *order_by]:
+            if key not in indexed_keys:
+                raise ValueError(f"Results are not indexed by {key}")
+        query = "SELECT * FROM results WHERE stage = ?"
+        parameters = [stage]
+        for key, value in criteria.items():
+            query += f" AND {key} = ?"
+            parameters.append(value)
+        if filenames is not None:
+            filenames = [os.path.normpath(filename) for filename in filenames]
+            query += f" AND filename IN ({', '.join(['?'] * len(filenames))})"
+            parameters.extend(filenames)
+        query += f" ORDER BY {', '.join([*order_by, 'filename'])}"
+
+        with self._connect() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record["identity"] = json.loads(record["identity"])
+            if record["identity"] != file_identity(record["filename"]):
+                continue
+            record["description"] = json.loads(record["description"])
+            record["observables"] = json.loads(record["observables"])
+            records.append(record)
+        return records
+
+
+def register_result(filename, description, observables=()):
+    """
+    Register filename in the catalogue named by SU2PV_CATALOGUE, if any,
+    as a result of the stage named after the running script.
+    """
+    catalogue = Catalogue.from_environment()
+    if catalogue is None:
+        return
+    stage = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    catalogue.register(filename, stage, description, observables)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="List the results of a stage recorded in the catalogue."
+    )
+    parser.add_argument("stage")
+    parser.add_argument(
+        "--catalogue_filename", default=os.environ.get("SU2PV_CATALOGUE")
+    )
+    parser.add_argument("--Npv", type=int, default=None)
+    parser.add_argument("--mpv", type=float, default=None)
+    parser.add_argument("--beta", type=float, default=None)
+    parser.add_argument("--L", type=int, default=None)
+    parser.add_argument("--time", type=float, default=None)
+    parser.add_argument("--operator", default=None)
+    args = parser.parse_args()
+    if not args.catalogue_filename:
+        parser.error("--catalogue_filename or SU2PV_CATALOGUE is required")
+    return args
+
+
+def main():
+    args = get_args()
+    criteria = {
+        key: getattr(args, key)
+        for key in indexed_keys
+        if getattr(args, key) is not None
+    }
+    for record in Catalogue(args.catalogue_filename).find(args.stage, **criteria):
+        print(record["filename"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,44 @@
 #!/usr/bin/env python3
 
+import os
+
 import pandas as pd
-import pyerrors as pe
+
+from catalogue import Catalogue
+from results import load_summary
+
+
+def get_summaries(filenames):
+    """
+    The summary of each of filenames, as load_summary gives it,
+    read in one query if the catalogue records them all,
+    and otherwise from the summary next to each file.
+    """
+    catalogue = Catalogue.from_environment()
+    if catalogue is not None:
+        records = {
+            record["filename"]: record
+            for record in catalogue.find("critical_mf", filenames=filenames)
+        }
+        filenames = [os.path.normpath(filename) for filename in filenames]
+        if all(filename in records for filename in filenames):
+            return [records[filename] for filename in filenames]
+    return [load_summary(filename) for filename in filenames]
 
 
 def get_data(filenames):
     data = []
-    for filename in filenames:
-        datum = pe.input.json.load_json(filename, full_output=True, verbose=False)
-        datum["obsdata"][0].gamma_method()
+    for summary in get_summaries(filenames):
+        description = summary["description"]
+        critical_mass = summary["observables"][0]
         data.append(
             {
-                "Npv": datum["description"]["Npv"],
-                "mpv": datum["description"]["mpv"],
-                "beta": datum["description"]["beta"],
-                "chisquare_per_dof": datum["description"]["chisquare"]
-                / datum["description"]["dof"],
-                "value_critical_mass": datum["obsdata"][0].value,
-                "error_critical_mass": datum["obsdata"][0].dvalue,
+                "Npv": description["Npv"],
+                "mpv": description["mpv"],
+                "beta": description["beta"],
+                "chisquare_per_dof": description["chisquare"] / description["dof"],
+                "value_critical_mass": critical_mass["value"],
+                "error_critical_mass": critical_mass["dvalue"],
             }
         )
     return pd.DataFrame(data)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+
+from flow_analysis.readers import readers
+import numpy as np
+
+from flow_store import FlowStoreWriter
+from logscan import LogScanner
+from plaquette import configuration_tag
+
+# The measurements HiRep writes at each flow time,
+# with or without the configuration number
+flow_log_scanner = LogScanner(
+    {
+        "configuration": configuration_tag,
+        "flow": (
+            rb"\[WILSONFLOW\]\[0\]WF[ \t]+\("
+            rb"(?:ncnfg,t,E,t2\*E,Esym,t2\*Esym,TC\)[ \t]+=[ \t]+[0-9]+"
+            rb"|t,E,t2\*E,Esym,t2\*Esym,TC\)[ \t]+=)"
+            rb"[ \t]+(?P<flow_time>\S+)[ \t]+(?P<plaq>\S+)[ \t]+\S+[ \t]+(?P<sym>\S+)",
+            {"flow_time": float, "plaq": float, "sym": float},
+        ),
+    }
+)
+scanned_operators = ("plaq", "sym")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Collate per-configuration Wilson flow logs into a single HDF5 file."
+        )
+    )
+    parser.add_argument("input_filenames", metavar="input_filename", nargs="*")
+    parser.add_argument("--output_filename", required=True)
+    parser.add_argument(
+        "--reader",
+        default="hirep",
+        help="flow_analysis reader giving the logs' metadata and flow step",
+    )
+    parser.add_argument(
+        "--operators", nargs="+", choices=scanned_operators, default=["plaq", "sym"]
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=200,
+        help="Number of configurations to hold before writing; limits memory use",
+    )
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch_size must be positive")
+    return args
+
+
+def scan_flows(filename):
+    """
+    Find the configuration and flow lines of a HiRep flow log,
+    recording under "configuration" in the flow records
+    the position of the configuration each flow line belongs to
+    (-1 for any before the first configuration).
+    """
+    records, _ = flow_log_scanner.scan(filename)
+    records["flow"]["configuration"] = (
+        np.searchsorted(records["configuration"]["index"], records["flow"]["index"]) - 1
+    )
+    return records
+
+
+def flow_lengths(records):
+    """
+    The number of flow lines following each configuration line.
+    """
+    owners = records["flow"]["configuration"]
+    return np.bincount(
+        owners[owners >= 0], minlength=len(records["configuration"]["index"])
+    )
+
+
+def get_reference(filenames, reader):
+    """
+    Find the flow times of a complete configuration,
+    taken as the longest flow of any configuration,
+    and read the metadata of a log containing one with reader.
+    Returns None if no log has a configuration with any flow.
+    """
+    num_times = 0
+    reference_filename = None
+    for filename in filenames:
+        lengths = flow_lengths(scan_flows(filename))
+        if len(lengths) > 0 and lengths.max() > num_times:
+            num_times = lengths.max()
+            reference_filename = filename
+    if reference_filename is None:
+        return None
+
+    flows = readers[reader](reference_filename)
+    if flows is None or len(flows.times) != num_times:
+        raise ValueError(
+            f"The {reader} reader doesn't find the {num_times} flow times "
+            f"of {reference_filename}"
+        )
+    return flows
+
+
+class FlowCollator:
+    """
+    Accumulate the E(t) of each complete configuration
+    into preallocated arrays of batch_size configurations,
+    writing them to writer each time they fill,
+    so that memory use is bounded by the batch size
+    rather than the size of the ensemble.
+
+    Configurations whose flow is incomplete, as at the end of a failed run,
+    are skipped. Replicas are the runs named in the configuration filenames.
+    """
+
+    def __init__(self, writer, name, times, operators, batch_size):
+        self.writer = writer
+        self.name = name
+        self.times = np.asarray(times)
+        self.operators = operators
+        self.run_names = np.empty(batch_size, dtype=object)
+        self.configs = np.empty(batch_size, dtype=int)
+        self.Es = {
+            operator: np.empty((batch_size, len(self.times))) for operator in operators
+        }
+        self.count = 0
+        self.plaquette_records = []
+
+    def add(self, filename, records):
+        self.plaquette_records.append(records["configuration"])
+        lengths = flow_lengths(records)
+        (complete,) = np.nonzero(lengths == len(self.times))
+
+        # Lines of each configuration are contiguous, in order
+        flow = records["flow"]
+        in_complete = np.isin(flow["configuration"], complete)
+        shape = (len(complete), len(self.times))
+        if not np.allclose(flow["flow_time"][in_complete].reshape(shape), self.times):
+            raise ValueError(f"Flow times in {filename} differ from other logs")
+        run_names = records["configuration"]["run_name"][complete]
+        configs = records["configuration"]["cfg_index"][complete]
+        Es = {
+            operator: flow[operator][in_complete].reshape(shape)
+            for operator in self.operators
+        }
+
+        start = 0
+        while start < len(complete):
+            count = min(len(complete) - start, len(self.configs) - self.count)
+            batch = slice(self.count, self.count + count)
+            added = slice(start, start + count)
+            self.run_names[batch] = run_names[added]
+            self.configs[batch] = configs[added]
+            for operator in self.operators:
+                self.Es[operator][batch] = Es[operator][added]
+            self.count += count
+            start += count
+            if self.count == len(self.configs):
+                self.flush()
+
+    def flush(self):
+        run_names = self.run_names[: self.count]
+        replicas = {}
+        # Keep replicas in the order they first appear
+        for run_name in dict.fromkeys(run_names):
+            in_run = run_names == run_name
+            replicas[f"{self.name}|{run_name.decode()}"] = {
+                "configs": self.configs[: self.count][in_run],
+                **{
+                    operator: self.Es[operator][: self.count][in_run]
+                    for operator in self.operators
+                },
+            }
+        self.writer.append(replicas, concatenate_records(self.plaquette_records))
+        self.count = 0
+        self.plaquette_records = []
+
+
+def concatenate_records(records):
+    keys = flow_log_scanner.dtypes["configuration"]
+    if not records:
+        return {key: np.zeros(0, dtype=dtype) for key, dtype in keys.items()}
+    return {key: np.concatenate([record[key] for record in records]) for key in keys}
+
+
+def collate(filenames, output_filename, reader, operators, batch_size):
+    """
+    Scan filenames one at a time, appending the flows of their
+    complete configurations to the output in batches.
+    The logs are scanned twice: first to find the length of a complete flow,
+    and then to collect the flows.
+    """
+    name = os.path.splitext(output_filename)[0]
+    reference = get_reference(filenames, reader)
+    with FlowStoreWriter(output_filename, reader) as writer:
+        if reference is None:
+            return
+        writer.set_metadata(
+            reference.times, reference.h, reference.reader, reference.metadata
+        )
+        collator = FlowCollator(writer, name, reference.times, operators, batch_size)
+        for filename in filenames:
+            collator.add(filename, scan_flows(filename))
+        collator.flush()
+
+
+def main():
+    args = get_args()
+    collate(
+        list(args.input_filenames),
+        args.output_filename,
+        args.reader,
+        args.operators,
+        args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
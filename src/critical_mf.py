@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pyerrors as pe
 
+from results import dump_obs, load_list
+
 
 def get_args():
     from argparse import ArgumentParser
@@ -82,8 +84,10 @@ def write_result(fit_result, args, metadata):
         print(fit_result.fit_parameters[0])
         return
 
-    fit_result.fit_parameters[0].dump(
-        args.output_filename, description=get_description(fit_result, args, metadata)
+    dump_obs(
+        fit_result.fit_parameters[0],
+        args.output_filename,
+        description=get_description(fit_result, args, metadata),
     )
 
 
@@ -129,10 +133,7 @@ def plot_result(data, fit_results, output_filename):
 
 def main():
     args = get_args()
-    data = [
-        pe.input.json.load_json(filename, full_output=True, verbose=False)
-        for filename in args.pcac_mass_filenames
-    ]
+    data = [load_list(filename) for filename in args.pcac_mass_filenames]
     metadata = get_consistent_metadata(data)
     fit_result = fit(data)
     fit_result.fit_parameters[0].gamma_method()
@@ -2,32 +2,63 @@
 
 import argparse
 
-import pyerrors as pe
+import numpy as np
 
+from linear_fits import SubsetFits
 from provenance import describe_inputs, get_consistent_metadata
-from read import get_all_flows
-from stats import weighted_mean
-from utils import zip_combinations
+from read import get_all_flows_by_operator, time_index
+from results import dump_dict
+from stats import weighted_mean, weighted_mean_by_uncertainty
+from utils import cap_subsets, largest_subsets, subset_strategies
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("flow_filenames", metavar="flow_filename", nargs="+")
     parser.add_argument("--reader", default="hirep")
-    parser.add_argument("--operator", default="sym")
-    parser.add_argument("--output_filename", default=None)
-    parser.add_argument("--time", required=True, type=float)
+    parser.add_argument("--operator", nargs="+", default=["sym"])
+    parser.add_argument(
+        "--output_filename",
+        default=None,
+        help=(
+            "May contain {time} and {operator} placeholders, "
+            "which are required when several of either are requested."
+        ),
+    )
+    parser.add_argument("--time", nargs="+", required=True, type=float)
     parser.add_argument("--Npv", default=None, type=int)
     parser.add_argument("--mpv", default=None, type=float)
     parser.add_argument("--beta", default=None, type=float)
-    return parser.parse_args()
+    parser.add_argument("--subset_strategy", choices=subset_strategies, default="all")
+    parser.add_argument(
+        "--max_dropped",
+        default=None,
+        type=int,
+        help="Largest number of smallest volumes to drop with drop_smallest",
+    )
+    parser.add_argument(
+        "--max_models",
+        default=None,
+        type=int,
+        help="Largest number of volume subsets to include in the model average",
+    )
+    args = parser.parse_args()
+
+    if args.output_filename:
+        for placeholder, values in ("time", args.time), ("operator", args.operator):
+            if len(values) > 1 and f"{{{placeholder}}}" not in args.output_filename:
+                parser.error(
+                    f"--output_filename must contain {{{placeholder}}} "
+                    f"when more than one {placeholder} is given"
+                )
+
+    return args
 
 
 def get_scales_at_time(flows, scale, time):
     result = []
     for flow in flows:
-        index = int(time / flow["h"])
-        result.append(flow[scale][index])
+        result.append(flow[scale][time_index(time, flow["h"])])
 
     return result
 
@@ -36,28 +67,29 @@ def linear_fit(a, x):
     return a[0] + a[1] * x
 
 
-def fit_single(x_values, y_values):
-    result = pe.fits.least_squares(x_values, y_values, linear_fit, silent=True)
+def get_subsets(flows, strategy="all", max_models=None, **options):
+    L_values = [flow["NX"] for flow in flows]
+    if strategy == "all" and max_models is not None:
+        # Avoid enumerating all 2^n subsets only to keep a few of them
+        return largest_subsets(L_values, min_count=3, max_count=max_models)
+    subsets = subset_strategies[strategy](L_values, min_count=3, **options)
+    if max_models is not None:
+        subsets = cap_subsets(subsets, L_values, max_models)
+    return subsets
 
-    # Eq. (7) of 2402.18038 to compute AIC weight
-    return result, result.chisquare_by_dof + 2 * len(result.fit_parameters)
 
-
-def fit_scale(flows, scale, time):
+def fit_scale(flows, scale, time, subsets):
     x_values = [1 / flow["NX"] ** 4 for flow in flows]
     scale_values = get_scales_at_time(flows, scale, time)
     for value in scale_values:
         value.gamma_method()
-    fit_results = [
-        fit_single(x_subset, scale_subset)
-        for x_subset, scale_subset in zip_combinations(
-            x_values, scale_values, min_count=3
-        )
-    ]
+    fit_results = SubsetFits(
+        x_values, scale_values, subsets, basis=[np.ones_like, lambda x: x]
+    )
     return weighted_mean(fit_results)
 
 
-def get_metadata(flows, operator, time):
+def get_metadata(flows, operator, time, subset_options):
     description = "Infinite volume extrapolation for gradient flow data."
     ensemble_keys = ["filename", "NX", "NY", "NZ", "NT", "reader"]
     consistent_keys = ["Npv", "mpv", "beta", "Nc"]
@@ -68,34 +100,61 @@ def get_metadata(flows, operator, time):
         consistent_keys,
         operator=operator,
         time=time,
+        **subset_options,
     )
 
 
 def main():
     args = get_args()
-    flows = get_all_flows(
+    flows_by_operator = get_all_flows_by_operator(
         args.flow_filenames,
         reader=args.reader,
-        operator=args.operator,
+        operators=args.operator,
         extra_metadata={"Nc": 2, "Npv": args.Npv, "mpv": args.mpv, "beta": args.beta},
+        times=args.time,
     )
 
-    # Ensure a single consistent beta will be fit
-    get_consistent_metadata(flows, "beta")
+    strategy_options = {}
+    if args.subset_strategy == "drop_smallest":
+        strategy_options["max_dropped"] = args.max_dropped
 
-    result = {
-        scale: fit_scale(flows, scale, args.time) for scale in ["gGF^2", "betaGF"]
-    }
-
-    if args.output_filename:
-        pe.input.json.dump_dict_to_json(
-            result,
-            args.output_filename,
-            description=get_metadata(flows, args.operator, args.time),
+    for operator, flows in flows_by_operator.items():
+        # Ensure a single consistent beta will be fit
+        get_consistent_metadata(flows, "beta")
+        subsets = get_subsets(
+            flows, args.subset_strategy, args.max_models, **strategy_options
         )
-    else:
-        for observable, value in result.items():
-            print(f"{observable}: {value}")
+        # Record the strategy and the volumes in each subset
+        # so that the model average can be reproduced
+        subset_options = {
+            "subset_strategy": args.subset_strategy,
+            "max_models": args.max_models,
+            **strategy_options,
+            "subset_volumes": [
+                [flows[index]["NX"] for index in subset] for subset in subsets
+            ],
+        }
+
+        for time in args.time:
+            result = {
+                scale: fit_scale(flows, scale, time, subsets)
+                for scale in ["gGF^2", "betaGF"]
+            }
+            if all(flow["plaquette"] is not None for flow in flows):
+                result["plaquette"] = [
+                    weighted_mean_by_uncertainty([flow["plaquette"] for flow in flows])
+                ]
+
+            if args.output_filename:
+                dump_dict(
+                    result,
+                    args.output_filename.format(time=time, operator=operator),
+                    description=get_metadata(flows, operator, time, subset_options),
+                )
+            else:
+                print(f"t={time}, operator={operator}:")
+                for observable, value in result.items():
+                    print(f"{observable}: {value}")
 
 
 if __name__ == "__main__":
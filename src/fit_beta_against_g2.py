@@ -7,6 +7,7 @@ import pyerrors as pe
 
 from provenance import describe_inputs
 from read import read_all_fit_results
+from results import dump_dict
 
 
 def get_args():
@@ -56,7 +57,7 @@ def main():
             datum[key][0].gamma_method()
     result = fit_single(data, order=args.order)
     if args.output_filename:
-        pe.input.json.dump_dict_to_json(
+        dump_dict(
             {"beta_interpolation": result},
             args.output_filename,
             description=get_metadata(data, args.order),
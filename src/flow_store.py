@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import json
+
+import h5py
+import numpy as np
+
+from plaquette import flow_log_scanner, plaquette_from_records
+from samples import SampleMatrix
+
+format_version = 2
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't store {value!r} in flow metadata")
+
+
+def _h5py_dtype(dtype):
+    return h5py.string_dtype("ascii") if dtype is bytes else dtype
+
+
+class FlowStoreWriter:
+    """
+    Write collated Wilson flow data to an HDF5 file,
+    one batch of configurations at a time,
+    so that the whole ensemble never needs to be held in memory.
+
+    Each operator's E(t) is stored for each replica
+    as a (configurations x times) array, compressed in chunks of
+    chunk_size configurations, so that readers can load it without
+    parsing any text.
+    `reader_name` names the flow_analysis reader the logs were parsed with,
+    so that readers of the file can check it matches the one they expect.
+    """
+
+    def __init__(self, filename, reader_name, chunk_size=64):
+        self.filename = filename
+        self.reader_name = reader_name
+        self.chunk_size = chunk_size
+        self.times = None
+        self.replica_groups = {}
+
+    def __enter__(self):
+        self.file = h5py.File(self.filename, "w")
+        self.file.attrs["format_version"] = format_version
+        self.file.attrs["reader_name"] = self.reader_name
+        self.file.create_group("replicas")
+        plaquette_group = self.file.create_group("plaquette")
+        for key, dtype in flow_log_scanner.dtypes["configuration"].items():
+            plaquette_group.create_dataset(
+                key, shape=(0,), maxshape=(None,), dtype=_h5py_dtype(dtype)
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def set_metadata(self, times, h, reader, metadata):
+        if self.times is not None:
+            if not np.array_equal(times, self.times):
+                raise ValueError("Flow times differ between batches")
+            return
+
+        self.times = np.asarray(times)
+        self.file.attrs["h"] = h
+        self.file.attrs["reader"] = reader
+        self.file.attrs["metadata"] = json.dumps(metadata, default=_to_json)
+        self.file.create_dataset("times", data=self.times)
+
+    def _get_replica_group(self, name, operators):
+        if name not in self.replica_groups:
+            group = self.file["replicas"].create_group(str(len(self.replica_groups)))
+            group.attrs["name"] = name
+            group.create_dataset("configs", shape=(0,), maxshape=(None,), dtype=int)
+            for operator in operators:
+                group.create_dataset(
+                    operator,
+                    shape=(0, len(self.times)),
+                    maxshape=(None, len(self.times)),
+                    chunks=(self.chunk_size, len(self.times)),
+                    dtype=float,
+                    compression="gzip",
+                    shuffle=True,
+                )
+            self.replica_groups[name] = group
+        return self.replica_groups[name]
+
+    def append(self, replicas, plaquette_records):
+        """
+        Add a batch of data.
+        `replicas` maps each replica name to a dict holding
+        "configs", the configuration indices,
+        and for each operator, the (configurations x times) array of E(t).
+        `plaquette_records` holds the records found by flow_log_scanner.
+        """
+        for name, replica in replicas.items():
+            operators = [key for key in replica if key != "configs"]
+            group = self._get_replica_group(name, operators)
+            for key, values in replica.items():
+                _append(group[key], values)
+
+        for key in flow_log_scanner.dtypes["configuration"]:
+            _append(self.file["plaquette"][key], plaquette_records[key])
+
+
+def _append(dataset, values):
+    start = len(dataset)
+    dataset.resize(start + len(values), axis=0)
+    dataset[start:] = values
+
+
+class StoredFlows:
+    """
+    Wilson flow data written by FlowStoreWriter,
+    providing the parts of the flow_analysis reader interface used here.
+    Arrays are only read from disk when requested.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with h5py.File(filename, "r") as f:
+            if f.attrs["format_version"] != format_version:
+                raise ValueError(
+                    f"{filename} has format version {f.attrs['format_version']}; "
+                    f"expected {format_version}"
+                )
+            self.reader_name = str(f.attrs["reader_name"])
+            self.h = float(f.attrs["h"])
+            self.reader = str(f.attrs["reader"])
+            self.metadata = json.loads(f.attrs["metadata"])
+            self.times = f["times"][()]
+
+    def get_samples(self, operator, indices=None):
+        """
+        Load E(t) for operator as a SampleMatrix.
+        If indices is given, only those time slices are read from disk.
+        """
+        samples = {}
+        idl = {}
+        with h5py.File(self.filename, "r") as f:
+            for group in f["replicas"].values():
+                name = str(group.attrs["name"])
+                if indices is None:
+                    samples[name] = group[operator][()]
+                else:
+                    samples[name] = group[operator][:, sorted(indices)]
+                idl[name] = group["configs"][()]
+        return SampleMatrix(
+            samples,
+            idl,
+            len(self.times),
+            indices=None if indices is None else sorted(indices),
+        )
+
+    def get_Es_pyerrors(self, operator="sym"):
+        return self.get_samples(operator).to_corr()
+
+    def get_plaquette(self):
+        with h5py.File(self.filename, "r") as f:
+            records = {key: dataset[()] for key, dataset in f["plaquette"].items()}
+        return plaquette_from_records(records)
+
+
+def read_stored_flows(filename, reader_name=None):
+    """
+    Open the flow data stored in filename, or return None if it is empty.
+    If reader_name is given, raise if the data were parsed with another reader.
+    """
+    with h5py.File(filename, "r") as f:
+        if len(f["replicas"]) == 0:
+            return None
+    flows = StoredFlows(filename)
+    if reader_name is not None and flows.reader_name != reader_name:
+        raise ValueError(
+            f"{filename} was collated with reader {flows.reader_name}, "
+            f"not {reader_name}"
+        )
+    return flows
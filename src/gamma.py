@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from pyerrors import Obs
+from pyerrors.obs import _determine_gap
+
+
+def _can_batch(observables):
+    template = observables[0]
+    if template.cov_names:
+        return False
+    if any(
+        Obs.tau_exp_dict.get(e_name, Obs.tau_exp_global) > 0
+        for e_name in template.mc_names
+    ):
+        return False
+    return all(
+        obs.names == template.names
+        and not obs.cov_names
+        and all(obs.idl[name] == template.idl[name] for name in template.names)
+        for obs in observables
+    )
+
+
+def _expand_deltas(deltas, idx, gapsize):
+    # As pyerrors.obs._expand_deltas, for a (configurations x slices) array
+    if isinstance(idx, range) and idx.step == gapsize:
+        return deltas
+    expanded = np.zeros(((idx[-1] - idx[0] + gapsize) // gapsize, deltas.shape[1]))
+    expanded[(np.asarray(idx) - idx[0]) // gapsize] = deltas
+    return expanded
+
+
+def _calc_gamma(deltas, idx, w_max, gapsize):
+    # As Obs._calc_gamma with fft=True, for each column of deltas at once
+    gamma = np.zeros((w_max, deltas.shape[1]))
+    deltas = _expand_deltas(deltas, idx, gapsize)
+    new_shape = len(deltas)
+    max_gamma = min(new_shape, w_max)
+    # The padding for the fft has to be even
+    padding = new_shape + max_gamma + (new_shape + max_gamma) % 2
+    gamma[:max_gamma] += np.fft.irfft(
+        np.abs(np.fft.rfft(deltas, padding, axis=0)) ** 2, axis=0
+    )[:max_gamma]
+    return gamma
+
+
+def _drho(rho, i, w_max, e_N):
+    # hep-lat/0306017 eq. (E.11), as computed in Obs.gamma_method
+    tmp = (
+        rho[i + 1 : w_max]
+        + np.concatenate(
+            [
+                rho[
+                    i - 1 : None
+                    if i - (w_max - 1) // 2 <= 0
+                    else (2 * i - (2 * w_max) // 2) : -1
+                ],
+                rho[1 : max(1, w_max - 2 * i)],
+            ]
+        )
+        - 2 * rho[i] * rho[1 : w_max - i]
+    )
+    return np.sqrt(np.sum(tmp**2) / e_N)
+
+
+def _analyse_ensemble(observables, e_name):
+    """
+    Compute the error contribution of ensemble e_name to each observable,
+    returning a dict of per-observable attributes for each quantity.
+    """
+    template = observables[0]
+    e_content = template.e_content
+    S = Obs.S_dict.get(e_name, Obs.S_global)
+    gapsize = _determine_gap(template, e_content, e_name)
+
+    r_length = []
+    for r_name in e_content[e_name]:
+        idx = template.idl[r_name]
+        if isinstance(idx, range):
+            r_length.append(len(idx) * idx.step // gapsize)
+        else:
+            r_length.append((idx[-1] - idx[0] + 1) // gapsize)
+    e_N = np.sum([template.shape[r_name] for r_name in e_content[e_name]])
+    w_max = max(r_length) // 2
+
+    gamma = np.zeros((w_max, len(observables)))
+    gamma_div = np.zeros((w_max, 1))
+    for r_name in e_content[e_name]:
+        idx = template.idl[r_name]
+        deltas = np.column_stack([obs.deltas[r_name] for obs in observables])
+        gamma += _calc_gamma(deltas, idx, w_max, gapsize)
+        gamma_div += _calc_gamma(
+            np.ones((template.shape[r_name], 1)), idx, w_max, gapsize
+        )
+    gamma_div[gamma_div < 1] = 1.0
+    gamma /= gamma_div
+
+    zero = np.abs(gamma[0]) < 10 * np.finfo(float).tiny
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rho = gamma / gamma[0]
+    n_tauint = np.cumsum(
+        np.concatenate([np.full((1, len(observables)), 0.5), rho[1:]]), axis=0
+    )
+    # Make sure no entry of tauint is smaller than 0.5
+    n_tauint[n_tauint <= 0.5] = 0.5 + np.finfo(np.float64).eps
+    # hep-lat/0306017 eq. (42)
+    n_dtauint = (
+        n_tauint
+        * 2
+        * np.sqrt(np.abs(np.arange(w_max)[:, np.newaxis] + 0.5 - n_tauint) / e_N)
+    )
+    n_dtauint[0] = 0.0
+
+    if S == 0.0:
+        windows = np.zeros(len(observables), dtype=int)
+    else:
+        # Standard automatic windowing procedure, for all slices at once;
+        # the window is the first n for which g_w[n - 1] < 0
+        steps = np.arange(1, w_max)[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tau = S / np.log((2 * n_tauint[1:] + 1) / (2 * n_tauint[1:] - 1))
+            g_w = np.exp(-steps / tau) - tau / np.sqrt(steps * e_N)
+        stop = g_w < 0
+        stop[w_max - 2 :] = True
+        windows = np.argmax(stop, axis=0) + 1
+
+    result = []
+    for column, window in enumerate(windows):
+        attributes = {
+            "rho": np.zeros(w_max),
+            "drho": np.zeros(w_max),
+        }
+        if zero[column]:
+            attributes.update(
+                tauint=0.5, dtauint=0.0, dvalue=0.0, ddvalue=0.0, windowsize=0
+            )
+            result.append(attributes)
+            continue
+
+        attributes["rho"] = rho[:, column]
+        attributes["n_tauint"] = n_tauint[:, column]
+        attributes["n_dtauint"] = n_dtauint[:, column]
+        gamma_0 = gamma[0, column]
+        if S == 0.0:
+            dvalue = np.sqrt(gamma_0 / (e_N - 1))
+            attributes.update(
+                tauint=0.5,
+                dtauint=0.0,
+                dvalue=dvalue,
+                ddvalue=dvalue * np.sqrt(0.5 / e_N),
+                windowsize=0,
+            )
+        else:
+            attributes["drho"][window] = _drho(attributes["rho"], window, w_max, e_N)
+            # Bias correction hep-lat/0306017 eq. (49)
+            tauint = (
+                n_tauint[window, column] * (1 + (2 * window + 1) / e_N) / (1 + 1 / e_N)
+            )
+            dvalue = np.sqrt(2 * tauint * gamma_0 * (1 + 1 / e_N) / e_N)
+            attributes.update(
+                tauint=tauint,
+                dtauint=n_dtauint[window, column],
+                dvalue=dvalue,
+                ddvalue=dvalue * np.sqrt((window + 0.5) / e_N),
+                windowsize=window,
+            )
+        result.append(attributes)
+    return result
+
+
+def gamma_method(observables):
+    """
+    Equivalent to calling gamma_method() with default arguments
+    on each of observables, which share the same replicas and configurations,
+    as do the time slices of a correlator.
+    The autocorrelation functions of all observables
+    are computed together with one FFT per replica,
+    and the automatic windowing is vectorised across observables.
+    Falls back to calling gamma_method() on each observable
+    when this is not possible.
+    """
+    observables = list(observables)
+    if not observables:
+        return
+    if not _can_batch(observables):
+        for obs in observables:
+            obs.gamma_method()
+        return
+
+    for obs in observables:
+        obs.e_dvalue = {}
+        obs.e_ddvalue = {}
+        obs.e_tauint = {}
+        obs.e_dtauint = {}
+        obs.e_windowsize = {}
+        obs.e_n_tauint = {}
+        obs.e_n_dtauint = {}
+        obs.e_rho = {}
+        obs.e_drho = {}
+        obs._dvalue = 0
+        obs.ddvalue = 0
+        obs.S = {}
+        obs.tau_exp = {}
+        obs.N_sigma = {}
+        for e_name in obs.e_names:
+            obs.S[e_name] = Obs.S_dict.get(e_name, Obs.S_global)
+            obs.tau_exp[e_name] = Obs.tau_exp_dict.get(e_name, Obs.tau_exp_global)
+            obs.N_sigma[e_name] = Obs.N_sigma_dict.get(e_name, Obs.N_sigma_global)
+
+    for e_name in observables[0].mc_names:
+        for obs, attributes in zip(observables, _analyse_ensemble(observables, e_name)):
+            obs.e_rho[e_name] = attributes["rho"]
+            obs.e_drho[e_name] = attributes["drho"]
+            if "n_tauint" in attributes:
+                obs.e_n_tauint[e_name] = attributes["n_tauint"]
+                obs.e_n_dtauint[e_name] = attributes["n_dtauint"]
+            obs.e_tauint[e_name] = attributes["tauint"]
+            obs.e_dtauint[e_name] = attributes["dtauint"]
+            obs.e_dvalue[e_name] = attributes["dvalue"]
+            obs.e_ddvalue[e_name] = attributes["ddvalue"]
+            obs.e_windowsize[e_name] = attributes["windowsize"]
+            obs._dvalue += attributes["dvalue"] ** 2
+            obs.ddvalue += (attributes["dvalue"] * attributes["ddvalue"]) ** 2
+
+    for obs in observables:
+        obs._dvalue = np.sqrt(obs._dvalue)
+        if obs._dvalue == 0.0:
+            obs.ddvalue = 0.0
+        else:
+            obs.ddvalue = np.sqrt(obs.ddvalue) / obs._dvalue
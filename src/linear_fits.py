@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from pyerrors.obs import derived_observable
+
+
+def linear_combination(observables, coefficients):
+    """
+    Return sum(coefficients * observables) as a single derived Obs,
+    propagating the Monte Carlo histories with the known gradient.
+    """
+    coefficients = np.asarray(coefficients, dtype=float)
+    return derived_observable(
+        lambda values, **kwargs: values @ coefficients,
+        list(observables),
+        man_grad=list(coefficients),
+    )
+
+
+class SubsetFitResults:
+    """
+    Results of fits of a model linear in its parameters
+    to many subsets of the same data points y_values.
+
+    coefficients[s, i, n] gives the weight of y_values[n]
+    in parameter i of the fit to subset s;
+    aic_penalty is added to chi^2 / dof of each fit to give its AIC.
+    """
+
+    def __init__(
+        self,
+        y_values,
+        subsets,
+        coefficients,
+        parameter_values,
+        chisquare,
+        dof,
+        aic_penalty,
+    ):
+        self.y_values = list(y_values)
+        self.subsets = [tuple(subset) for subset in subsets]
+        if not self.subsets:
+            raise ValueError("No subsets to fit.")
+        self.coefficients = coefficients
+        self.parameter_values = parameter_values
+        self.chisquare = chisquare
+        self.dof = dof
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.chisquare_by_dof = self.chisquare / self.dof
+        self.aic = self.chisquare_by_dof + aic_penalty
+
+    def __len__(self):
+        return len(self.subsets)
+
+    def weighted_coefficients(self, weights):
+        """
+        Coefficients of the y values in the weighted mean of the fit parameters
+        over all subsets.
+        """
+        weights = np.asarray(weights, dtype=float)
+        return np.einsum("s,sin->in", weights, self.coefficients) / weights.sum()
+
+
+class SubsetFits(SubsetFitResults):
+    """
+    Uncorrelated weighted least-squares fits of a model linear in its parameters,
+    y = sum_i a[i] * basis[i](x), to many subsets of the same data points.
+
+    All subsets are solved together in closed form.
+    Since each fit parameter is a linear combination of the y values,
+    coefficients[s, i, n] gives the weight of y_values[n]
+    in parameter i of the fit to subset s;
+    Monte Carlo histories are propagated using these.
+    This gives the same result as pe.fits.least_squares for such models.
+    """
+
+    def __init__(self, x_values, y_values, subsets, basis):
+        self.x_values = np.asarray(x_values, dtype=float)
+        y_values = list(y_values)
+        subsets = [tuple(subset) for subset in subsets]
+
+        num_points = len(y_values)
+        num_params = len(basis)
+        design = np.stack([function(self.x_values) for function in basis], axis=1)
+        y = np.asarray([value.value for value in y_values])
+        dy = np.asarray([value.dvalue for value in y_values])
+        if np.any(dy <= 0.0):
+            raise ValueError("Uncertainties must be positive; run gamma_method first.")
+
+        masks = np.zeros((len(subsets), num_points))
+        for index, subset in enumerate(subsets):
+            masks[index, list(subset)] = 1.0
+        weights = masks / dy**2
+
+        normal_matrices = np.einsum("sn,ni,nj->sij", weights, design, design)
+        weighted_design = np.einsum("sn,ni->sin", weights, design)
+        coefficients = np.linalg.solve(normal_matrices, weighted_design)
+
+        parameter_values = coefficients @ y
+        residuals = y - parameter_values @ design.T
+        super().__init__(
+            y_values,
+            subsets,
+            coefficients,
+            parameter_values,
+            chisquare=np.sum(weights * residuals**2, axis=1),
+            dof=masks.sum(axis=1) - num_params,
+            # Eq. (7) of 2402.18038 to compute AIC weight
+            aic_penalty=2 * num_params,
+        )
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import itertools
+import mmap
+import os
+import re
+
+import numpy as np
+
+
+class LogScanner:
+    """
+    Bulk extraction of tagged lines from large text logs, such as HiRep output.
+
+    `tags` maps a name for each kind of line to (pattern, dtypes),
+    where pattern is a bytes regular expression matching the start of the line,
+    with a named group for each value to extract,
+    and dtypes maps each group name to the dtype to convert it to
+    (bytes to leave it unconverted).
+    Groups must not match empty strings,
+    as an empty first group is how lines of other tags are told apart.
+
+    Patterns should use [ \\t] rather than \\s to match spaces,
+    so that they cannot match across lines.
+
+    All tags are matched in one pass of a single regular expression
+    over a memory map of the file,
+    so lines without any of the tags are skipped without reaching Python.
+    """
+
+    def __init__(self, tags):
+        self.dtypes = {tag: dtypes for tag, (_, dtypes) in tags.items()}
+        alternatives = b"|".join(b"(?:%s)" % pattern for pattern, _ in tags.values())
+        # Matching the newline before each line, rather than using ^ with
+        # re.MULTILINE, lets the regular expression engine skip quickly
+        # to the start of each line
+        self.regex = re.compile(b"\n(?:%s)" % alternatives)
+        self.first_line_regex = re.compile(alternatives)
+        self.columns = {
+            name: number - 1 for name, number in self.regex.groupindex.items()
+        }
+
+    def _finditer(self, contents, start, end):
+        """
+        Yield (offset, match) for each tagged line starting at or after start.
+        """
+        if start == 0:
+            if match := self.first_line_regex.match(contents, 0, end):
+                yield 0, match
+        for match in self.regex.finditer(contents, max(start - 1, 0), end):
+            yield match.start() + 1, match
+
+    def _empty_records(self):
+        return {
+            tag: {
+                "index": np.zeros(0, dtype=int),
+                **{group: np.zeros(0, dtype=dtype) for group, dtype in dtypes.items()},
+            }
+            for tag, dtypes in self.dtypes.items()
+        }
+
+    def scan(self, filename, start=0, resumable=False):
+        """
+        Find all tagged lines from byte offset `start` (which must be the start
+        of a line) to the end of the file.
+        If resumable, the file may still be being written to,
+        so a final line without a newline is left unread,
+        to be read by a later scan from `end` once it is complete.
+
+        Returns (records, end), where end is the offset one past the last
+        line read, and records[tag] is a dict of arrays holding
+        each group's values, and under "index",
+        the position of each match among matches of all tags,
+        so that the order of lines with different tags can be recovered.
+        """
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= start:
+                return self._empty_records(), start
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                return self.scan_buffer(contents, start=start, resumable=resumable)
+
+    def scan_buffer(self, contents, start=0, resumable=False):
+        """
+        As scan, but for contents already in memory (bytes or an mmap).
+        """
+        if resumable:
+            end = contents.rfind(b"\n", start) + 1
+            if end == 0:
+                return self._empty_records(), start
+        else:
+            end = len(contents)
+        matches = self.regex.findall(contents, max(start - 1, 0), end)
+        if start == 0 and (
+            first_match := self.first_line_regex.match(contents, 0, end)
+        ):
+            matches.insert(0, first_match.groups(default=b""))
+
+        matches = np.asarray(matches, dtype=bytes).reshape(
+            len(matches), self.regex.groups
+        )
+        records = {}
+        for tag, dtypes in self.dtypes.items():
+            columns = [self.columns[group] for group in dtypes]
+            (index,) = np.nonzero(matches[:, columns[0]])
+            records[tag] = {"index": index}
+            for group, column in zip(dtypes, columns):
+                records[tag][group] = matches[index, column].astype(dtypes[group])
+        return records, end
+
+    def locate(self, filename, start, match_index):
+        """
+        Return the byte offset and (zero-based) line number of
+        match number `match_index` of a scan starting at `start`.
+        """
+        with open(filename, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                offset, _ = next(
+                    itertools.islice(
+                        self._finditer(contents, start, len(contents)),
+                        match_index,
+                        None,
+                    )
+                )
+                line_number = np.count_nonzero(
+                    np.frombuffer(contents, dtype=np.uint8, count=offset) == ord("\n")
+                )
+        return offset, line_number
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ProcessPoolExecutor
+import functools
+
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 
@@ -8,6 +11,10 @@ from meson_analysis.fits import fit_pcac, pcac_eff_mass
 
 import numpy as np
 
+from linear_fits import SubsetFitResults, linear_combination
+from results import dump_obs
+from stats import weighted_mean as weighted_mean_of_fits
+
 
 def pcac_aic(correlator, range):
     result = fit_pcac(correlator, range, full=True)
@@ -18,7 +25,75 @@ def pcac_aic(correlator, range):
     return result, chisquare_aug + 2 * k + 2 * Ncut
 
 
+class PlateauFits(SubsetFitResults):
+    """
+    Uncorrelated constant fits to the PCAC effective mass
+    over many windows [tmin, tmax], with AICs as in pcac_aic.
+
+    All windows are solved together from prefix sums of the weighted data,
+    rather than fitting each separately with fit_pcac.
+    """
+
+    def __init__(self, eff_mass, fit_ranges, NT):
+        y_values = [eff_mass[t] for t in range(eff_mass.T)]
+        valid = np.asarray([value is not None for value in y_values])
+        y = np.asarray(
+            [value.value if value is not None else 0.0 for value in y_values]
+        )
+        dy = np.asarray(
+            [value.dvalue if value is not None else np.inf for value in y_values]
+        )
+        if np.any(dy[valid] <= 0.0):
+            raise ValueError("Uncertainties must be positive; run gamma_method first.")
+        weights = np.where(valid, 1 / dy**2, 0.0)
+
+        # Subtracting a reference value improves the conditioning of chi^2
+        reference = np.sum(weights * y) / np.sum(weights)
+        shifted_y = np.where(valid, y - reference, 0.0)
+
+        tmin, tmax = np.asarray(fit_ranges).T
+
+        def window_sums(values):
+            prefix_sums = np.concatenate([[0.0], np.cumsum(values)])
+            return prefix_sums[tmax + 1] - prefix_sums[tmin]
+
+        total_weights = window_sums(weights)
+        weighted_sums = window_sums(weights * shifted_y)
+        counts = window_sums(valid)
+
+        times = np.arange(len(y_values))
+        in_window = (tmin[:, np.newaxis] <= times) & (times <= tmax[:, np.newaxis])
+        super().__init__(
+            y_values,
+            [
+                tuple(t for t in range(start, end + 1) if valid[t])
+                for start, end in zip(tmin, tmax)
+            ],
+            (in_window * weights / total_weights[:, np.newaxis])[:, np.newaxis, :],
+            (weighted_sums / total_weights + reference)[:, np.newaxis],
+            chisquare=(
+                window_sums(weights * shifted_y**2) - weighted_sums**2 / total_weights
+            ),
+            dof=counts - 1,
+            # As in pcac_aic, with one fit parameter
+            aic_penalty=2 + 2 * (NT - (tmin - tmax)),
+        )
+
+    def fit_parameters(self, index):
+        """
+        The fit parameters of window index as Obs, for plotting.
+        """
+        subset = list(self.subsets[index])
+        return [
+            linear_combination([self.y_values[point] for point in subset], row[subset])
+            for row in self.coefficients[index]
+        ]
+
+
 def weighted_mean(results):
+    if isinstance(results, PlateauFits):
+        return weighted_mean_of_fits(results)[0]
+
     values = [result.fit_parameters[0] for result, aic in results]
     weights = [np.exp(-aic) for result, aic in results]
     result = sum([value * weight for value, weight in zip(values, weights)]) / sum(
@@ -34,6 +109,27 @@ def add_band(ax, result):
     ax.axhline(result.value - result.dvalue, dashes=(2, 2))
 
 
+def _pcac_aic_for_pool(correlator, fit_range):
+    # The fit function is typically a local function,
+    # so can't be returned from a worker process
+    result, aic = pcac_aic(correlator, fit_range)
+    result.fit_function = None
+    return result, aic
+
+
+def get_window_results(results):
+    if isinstance(results, PlateauFits):
+        values = [results.fit_parameters(index)[0] for index in range(len(results))]
+        aics = list(results.aic)
+    else:
+        values = [result.fit_parameters[0] for result, aic in results]
+        aics = [aic for result, aic in results]
+
+    for value in values:
+        value.gamma_method()
+    return values, aics
+
+
 def plot_results(correlator, results, output_filename=None):
     plt.style.use("styles/paperdraft.mplstyle")
 
@@ -41,6 +137,7 @@ def plot_results(correlator, results, output_filename=None):
     t, meff_value, meff_err = meff.plottable()
 
     result = weighted_mean(results)
+    window_values, window_aics = get_window_results(results)
 
     fig = plt.Figure(layout="constrained")
 
@@ -56,9 +153,9 @@ def plot_results(correlator, results, output_filename=None):
 
     ax1.set_ylabel(r"$m_{\mathrm{eff}}$")
     ax1.errorbar(
-        list(range(len(results))),
-        [result.fit_parameters[0].value for result, aic in results],
-        yerr=[result.fit_parameters[0].dvalue for result, aic in results],
+        list(range(len(window_values))),
+        [value.value for value in window_values],
+        yerr=[value.dvalue for value in window_values],
         ls="none",
         capsize=1,
     )
@@ -68,8 +165,8 @@ def plot_results(correlator, results, output_filename=None):
     ax2.set_xlabel("Index")
     ax2.set_ylabel(r"$\log(p(M|D))$")
     ax2.scatter(
-        list(range(len(results))),
-        [-aic for result, aic in results],
+        list(range(len(window_aics))),
+        [-aic for aic in window_aics],
     )
 
     fig.suptitle(f"$m_{{\\mathrm{{PCAC}}}} = {result}$")
@@ -81,14 +178,35 @@ def plot_results(correlator, results, output_filename=None):
         plt.show()
 
 
-def get_pcacs_aic(correlator):
-    results = []
+def get_fit_ranges(NT):
+    return [
+        [tmin, tmax]
+        for tmin in range(4, NT // 2 - 1)
+        for tmax in range(tmin + 1, NT // 2)
+    ]
+
+
+def get_pcacs_batched(correlator):
+    eff_mass = pcac_eff_mass(correlator)
+    eff_mass.gamma_method()
+    return PlateauFits(eff_mass, get_fit_ranges(correlator.NT), correlator.NT)
 
-    for tmin in range(4, correlator.NT // 2 - 1):
-        for tmax in range(tmin + 1, correlator.NT // 2):
-            results.append(pcac_aic(correlator, [tmin, tmax]))
 
-    return results
+def get_pcacs_aic(correlator, jobs=1):
+    fit_ranges = get_fit_ranges(correlator.NT)
+    if jobs == 1:
+        return [pcac_aic(correlator, fit_range) for fit_range in fit_ranges]
+
+    # map returns results in submission order,
+    # so the output does not depend on the number of workers
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(
+            executor.map(
+                functools.partial(_pcac_aic_for_pool, correlator),
+                fit_ranges,
+                chunksize=max(1, len(fit_ranges) // (4 * jobs)),
+            )
+        )
 
 
 def get_args():
@@ -100,6 +218,18 @@ def get_args():
     parser.add_argument("--plot_filename", default=None)
     parser.add_argument("--Npv", type=int, default=None)
     parser.add_argument("--mpv", type=float, default=None)
+    parser.add_argument(
+        "--method",
+        choices=["batched", "scan"],
+        default="batched",
+        help=(
+            "Solve all fit windows together (batched), "
+            "or fit each window separately with fit_pcac (scan)"
+        ),
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of processes for the scan method"
+    )
     return parser.parse_args()
 
 
@@ -121,11 +251,18 @@ def main():
     correlator.metadata["Npv"] = args.Npv
     correlator.metadata["mpv"] = args.mpv
 
-    results = get_pcacs_aic(correlator)
+    if args.method == "batched":
+        results = get_pcacs_batched(correlator)
+    else:
+        results = get_pcacs_aic(correlator, jobs=args.jobs)
     mpcac_result = weighted_mean(results)
 
     if args.output_filename:
-        mpcac_result.dump(args.output_filename, description=get_description(correlator))
+        dump_obs(
+            mpcac_result,
+            args.output_filename,
+            description=get_description(correlator),
+        )
     else:
         print("mPCAC =", mpcac_result)
 
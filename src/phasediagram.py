@@ -1,20 +1,22 @@
-from glob import glob
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from itertools import product
+import hashlib
 import logging
+import os
+import re
 
 import argparse
-from joblib import Memory
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
 import polars as pl
 import pyerrors as pe
 
+from cache import memory
+from logscan import LogScanner
 from plots import save_or_show
 
-
-memory = Memory("cache")
-
 betas = [1.4, 1.5, 1.6, 1.7, 1.8, 1.9, 2.0, 2.1, 2.2, 2.3, 2.4, 2.5, 2.6, 2.7, 2.8]
 masses = [
     -2.9,
@@ -75,42 +77,164 @@ def get_args():
     parser.add_argument("--input_dirname", default=".")
     parser.add_argument("--use_title", action="store_true")
     parser.add_argument("--plot_styles", default="styles/paperdraft.mplstyle")
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of processes to read logs with"
+    )
     return parser.parse_args()
 
 
+hmc_log_scanner = LogScanner(
+    {
+        "md_parameters": (
+            rb"\[MD_INT\]\[10\]MD parameters:[ \t]+\S+[ \t]+"
+            rb"[^\s=]+=(?P<tlen>[^\s=]+)[ \t]+[^\s=]+=(?P<nsteps>[^\s=]+)",
+            {"tlen": float, "nsteps": int},
+        ),
+        "trajectory": (
+            rb"\[MAIN\]\[0\]Trajectory #(?P<trajectory>[0-9]+)",
+            {"trajectory": int},
+        ),
+        "plaquette": (
+            rb"\[MAIN\]\[0\]Plaquette:[ \t]+(?P<plaquette>\S+)",
+            {"plaquette": float},
+        ),
+        "accept": (
+            rb"\[HMC\]\[10\]Configuration[ \t]+(?P<accepted>\S+)",
+            {"accepted": bytes},
+        ),
+    }
+)
+
+
+def _empty_parse_state():
+    return {
+        "offset": 0,
+        "head_size": 0,
+        "head_hash": None,
+        "stopped_at": None,
+        "tlen": None,
+        "nsteps": None,
+        "trajectory": None,
+        "trajectories": np.zeros(0, dtype=int),
+        "plaquettes": np.zeros(0, dtype=float),
+        "accepts": np.zeros(0, dtype=int),
+    }
+
+
+def _update_state(state, records, filename, start):
+    """
+    Add the lines found by hmc_log_scanner from offset start to state,
+    stopping if the log goes backwards.
+    """
+    plaquette_index = records["plaquette"]["index"]
+    trajectory_index = records["trajectory"]["index"]
+
+    # Each plaquette belongs to the most recent trajectory line
+    previous_trajectory = np.searchsorted(trajectory_index, plaquette_index) - 1
+    if state["trajectory"] is None and np.any(previous_trajectory < 0):
+        raise ValueError(f"Plaquette before first trajectory in {filename}")
+    trajectories = np.concatenate(
+        [[state["trajectory"] or 0], records["trajectory"]["trajectory"]]
+    )[previous_trajectory + 1]
+
+    last_trajectories = np.concatenate([state["trajectories"][-1:], trajectories])
+    (backwards,) = np.nonzero(last_trajectories[1:] < last_trajectories[:-1])
+    if len(backwards) > 0:
+        stop_index = plaquette_index[backwards[0] - len(state["trajectories"][-1:]) + 1]
+        _, state["stopped_at"] = hmc_log_scanner.locate(filename, start, stop_index)
+        for tag_records in records.values():
+            keep = tag_records["index"] < stop_index
+            for group, values in tag_records.items():
+                tag_records[group] = values[keep]
+        trajectories = trajectories[: len(records["plaquette"]["index"])]
+
+    for name in "tlen", "nsteps":
+        values = records["md_parameters"][name]
+        if state[name] is not None:
+            values = np.concatenate([[state[name]], values])
+        if len(values) == 0:
+            continue
+        if np.any(values != values[0]):
+            raise ValueError(f"Inconsistent {name}")
+        state[name] = values[0].item()
+
+    if len(records["trajectory"]["trajectory"]) > 0:
+        state["trajectory"] = records["trajectory"]["trajectory"][-1].item()
+    state["trajectories"] = np.concatenate([state["trajectories"], trajectories])
+    state["plaquettes"] = np.concatenate(
+        [state["plaquettes"], records["plaquette"]["plaquette"]]
+    )
+    state["accepts"] = np.concatenate(
+        [state["accepts"], records["accept"]["accepted"] == b"accepted."]
+    ).astype(int)
+
+
+def _head_hash(f, size):
+    f.seek(0)
+    return hashlib.sha256(f.read(size)).hexdigest()
+
+
+def parse_hmc_log(filename):
+    """
+    Read tlen, nsteps, and the trajectory, plaquette, and acceptance histories
+    from an HMC log.
+
+    The parse state is saved after each call,
+    so that a log that is still being written to
+    is only read from where the previous call left off.
+    A final line without a newline is included in the result,
+    but not in the saved state,
+    so that the next call reads it again in case it was still being written.
+    If the file has been truncated or rewritten since then,
+    it is parsed again from the start.
+    """
+    state = memory.load_state("hmc_log", os.path.abspath(filename))
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if state is not None and (
+            size < state["offset"]
+            or _head_hash(f, state["head_size"]) != state["head_hash"]
+        ):
+            logging.info(f"File {filename} has changed; parsing from the start")
+            state = None
+        if state is None:
+            state = _empty_parse_state()
+
+        if state["stopped_at"] is None:
+            start = state["offset"]
+            records, state["offset"] = hmc_log_scanner.scan(
+                filename, start=start, resumable=True
+            )
+            _update_state(state, records, filename, start)
+            state["head_size"] = min(state["offset"], 4096)
+            state["head_hash"] = _head_hash(f, state["head_size"])
+            memory.save_state("hmc_log", os.path.abspath(filename), state)
+
+    if state["stopped_at"] is None:
+        # Any unterminated final line, applied to a copy of the saved state
+        start = state["offset"]
+        records, _ = hmc_log_scanner.scan(filename, start=start)
+        state = dict(state)
+        _update_state(state, records, filename, start)
+
+    if state["stopped_at"] is not None:
+        logging.warning(
+            f"File {filename} goes backwards; "
+            f"skipping line {state['stopped_at']} onwards"
+        )
+    return state
+
+
 @memory.cache
 def read_single_file(filename, therm=100):
     accept_threshold = 0.2
 
-    tlen = None
-    nsteps = None
-    trajectories = []
-    plaquettes = []
-    accepts = []
-    with open(filename, "r") as f:
-        for line_number, line in enumerate(f):
-            if line.startswith("[MD_INT][10]MD parameters:"):
-                read_tlen = float(line.split()[3].split("=")[1])
-                read_nsteps = int(line.split()[4].split("=")[1])
-                if tlen is not None and read_tlen != tlen:
-                    raise ValueError("Inconsistent tlen")
-                if nsteps is not None and read_nsteps != nsteps:
-                    raise ValueError("Inconsistent nsteps")
-                tlen = read_tlen
-                nsteps = read_nsteps
-
-            elif line.startswith("[MAIN][0]Trajectory #"):
-                trajectory = int(line.split()[1].strip("#:."))
-            elif line.startswith("[MAIN][0]Plaquette:"):
-                if trajectories and trajectory < trajectories[-1]:
-                    logging.warning(
-                        f"File {filename} goes backwards; skipping line {line_number} onwards"
-                    )
-                    break
-                trajectories.append(trajectory)
-                plaquettes.append(float(line.split()[1]))
-            elif line.startswith("[HMC][10]Configuration"):
-                accepts.append(1 if line.split()[1] == "accepted." else 0)
+    state = parse_hmc_log(filename)
+    tlen = state["tlen"]
+    nsteps = state["nsteps"]
+    trajectories = state["trajectories"]
+    plaquettes = state["plaquettes"]
+    accepts = state["accepts"]
 
     if len(plaquettes) < 21:
         logging.warning(f"Skipping {filename} as only {len(plaquettes)} trajectories")
@@ -134,15 +258,78 @@ def read_single_file(filename, therm=100):
     }
 
 
-def get_plaquette(npv, mpv, beta, mass, dirname="."):
-    data = []
-    mpv_slug = "" if npv == 0 else f"_mpv{mpv}"
-    for filename in glob(
-        f"{dirname}/{npv}pv/out_hmc_{npv}pv_beta{beta}_m{mass}{mpv_slug}_*"
-    ):
-        datum = read_single_file(filename)
-        if datum:
-            data.append(datum)
+hmc_filename_pattern = re.compile(
+    r"out_hmc_(?P<npv>[0-9]+)pv_beta(?P<beta>[^_]+)_m(?P<mass>[^_]+)"
+    r"(?:_mpv(?P<mpv>[^_]+))?_"
+)
+
+
+@memory.cache(file_args=("dirnames",))
+def index_hmc_files(dirnames):
+    """
+    Find all HMC logs in the {npv}pv subdirectories listed in dirnames,
+    keyed by (npv, mpv, beta, mass) formatted as they are in the filenames.
+    The cache is invalidated when any of the directories changes.
+    """
+    index = defaultdict(list)
+    for dirname in dirnames:
+        dir_npv = int(os.path.basename(dirname).removesuffix("pv"))
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if not (match := hmc_filename_pattern.match(entry.name)):
+                    continue
+                npv = int(match["npv"])
+                if npv != dir_npv:
+                    continue
+                mpv = None if npv == 0 else match["mpv"]
+                index[npv, mpv, match["beta"], match["mass"]].append(
+                    os.path.join(dirname, entry.name)
+                )
+    return {key: sorted(filenames) for key, filenames in index.items()}
+
+
+def get_hmc_index(dirname="."):
+    pv_dirnames = sorted(
+        os.path.join(dirname, entry.name)
+        for entry in os.scandir(dirname)
+        if entry.is_dir() and re.fullmatch("[0-9]+pv", entry.name)
+    )
+    return index_hmc_files(pv_dirnames)
+
+
+def read_files(filenames, jobs=1):
+    """
+    Read each of filenames with read_single_file,
+    returning a dict from filename to result.
+    """
+    filenames = list(dict.fromkeys(filenames))
+    if jobs == 1:
+        return {filename: read_single_file(filename) for filename in filenames}
+
+    # map returns results in submission order,
+    # so the result does not depend on which worker finishes first
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(
+            read_single_file,
+            filenames,
+            chunksize=max(1, len(filenames) // (4 * jobs)),
+        )
+        return dict(zip(filenames, results))
+
+
+def get_ensemble_filenames(index, npv, mpv, beta, mass):
+    mpv_key = None if npv == 0 else f"{mpv}"
+    return index.get((npv, mpv_key, f"{beta}", f"{mass}"), [])
+
+
+def get_plaquette(npv, mpv, beta, mass, dirname=".", index=None, file_data=None):
+    if index is None:
+        index = get_hmc_index(dirname)
+    filenames = get_ensemble_filenames(index, npv, mpv, beta, mass)
+    if file_data is None:
+        file_data = read_files(filenames)
+
+    data = [file_data[filename] for filename in filenames if file_data[filename]]
     if not data:
         return
 
@@ -152,7 +339,16 @@ def get_plaquette(npv, mpv, beta, mass, dirname="."):
     return data[0]["plaquette"]
 
 
-def get_plaquettes(dirname="."):
+def get_plaquettes(dirname=".", jobs=1):
+    index = get_hmc_index(dirname)
+    file_data = read_files(
+        (
+            filename
+            for (npv, mpv), beta, mass in product(pv_specs, betas, masses)
+            for filename in get_ensemble_filenames(index, npv, mpv, beta, mass)
+        ),
+        jobs=jobs,
+    )
     results = pl.DataFrame(
         [
             {
@@ -161,7 +357,9 @@ def get_plaquettes(dirname="."):
                 "beta": beta,
                 "mass": mass,
                 "plaquette_value": (
-                    plaquette := get_plaquette(npv, mpv, beta, mass, dirname=dirname)
+                    plaquette := get_plaquette(
+                        npv, mpv, beta, mass, index=index, file_data=file_data
+                    )
                 )
                 or np.nan,
                 "plaquette_error": plaquette.dvalue if plaquette else np.nan,
@@ -290,7 +488,7 @@ def main():
     plt.style.use(args.plot_styles)
 
     title = r"HMC + $m=10,m+\delta m=m_{\mathrm{PV}}$" if args.use_title else ""
-    plaquettes = get_plaquettes(dirname=args.input_dirname)
+    plaquettes = get_plaquettes(dirname=args.input_dirname, jobs=args.jobs)
 
     save_or_show(
         plot_phasediagram_threepanel(plaquettes, title=title),
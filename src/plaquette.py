@@ -1,29 +1,44 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
-
+import numpy as np
 from pyerrors import Obs
 
+from logscan import LogScanner
 
-def read_plaquette_from_flows(filename):
-    indices = defaultdict(list)
-    plaquettes = defaultdict(list)
-
-    with open(filename, "r") as f:
-        for line in f:
-            if not line.startswith("[IO][0]Configuration"):
-                continue
-            split_line = line.split()
-            cfg_filename = split_line[1].strip("[]")
-            run_name = cfg_filename.split("/")[-1].split("_")[0]
-            cfg_index = int(cfg_filename.split("n")[-1])
-            plaquette = float(split_line[5].split("=")[-1])
-
-            indices[run_name].append(cfg_index)
-            plaquettes[run_name].append(plaquette)
+# The line HiRep writes on reading each configuration, with its plaquette
+configuration_tag = (
+    rb"\[IO\]\[0\]Configuration[ \t]+\[*(?:\S*/)?(?P<run_name>[^\s/_\]]+)"
+    rb"[^\s/\]]*n(?P<cfg_index>[0-9]+)\]*[ \t]+\S+[ \t]+\S+[ \t]+\S+[ \t]+"
+    rb"\S*=(?P<plaquette>[^\s=]+)",
+    {"run_name": bytes, "cfg_index": int, "plaquette": float},
+)
+
+flow_log_scanner = LogScanner({"configuration": configuration_tag})
+
+
+def plaquette_from_records(records):
+    """
+    Build the plaquette Obs from records found by flow_log_scanner,
+    or return None if they hold no configurations.
+    """
+    if len(records["plaquette"]) == 0:
+        return None
+
+    # Keep replicas in the order they first appear
+    run_names, first_index, replicas = np.unique(
+        records["run_name"], return_index=True, return_inverse=True
+    )
+    order = np.argsort(first_index)
 
     result = Obs(
-        list(plaquettes.values()), list(plaquettes), idl=list(indices.values())
+        [records["plaquette"][replicas == replica] for replica in order],
+        [run_names[replica].decode() for replica in order],
+        idl=[records["cfg_index"][replicas == replica] for replica in order],
     )
     result.gamma_method()
     return result
+
+
+def read_plaquette_from_flows(filename):
+    records, _ = flow_log_scanner.scan(filename)
+    return plaquette_from_records(records["configuration"])
@@ -18,6 +18,9 @@ def get_args():
     parser.add_argument("fit_filenames", nargs="+", metavar="beta_fit_filename")
     parser.add_argument("--plot_filename", default=None)
     parser.add_argument("--plot_styles", default="styles/paperdraft.mplstyle")
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of processes to read results with"
+    )
     return parser.parse_args()
 
 
@@ -40,7 +43,7 @@ def plot_fit(x_values, fit_result, ax, order=4, colour=None):
     )
 
 
-def plot(fit_results):
+def plot(fit_results, jobs=1):
     operators = sorted(set([datum["operator"] for datum in fit_results]))
     Npvs = sorted(set([datum["Npv"] for datum in fit_results]))
 
@@ -63,10 +66,20 @@ def plot(fit_results):
     for ax in axes[:, 0]:
         ax.set_ylabel(r"$\beta_{\mathrm{GF}}(t; g_0^2)$")
 
-    for result in fit_results:
-        data = read_all_fit_results(
-            [source["filename"] for source in result["data_sources"]]
+    # Read the inputs of all fits together, so they can be read in parallel
+    source_filenames = list(
+        dict.fromkeys(
+            source["filename"]
+            for result in fit_results
+            for source in result["data_sources"]
         )
+    )
+    sources = dict(
+        zip(source_filenames, read_all_fit_results(source_filenames, jobs=jobs))
+    )
+
+    for result in fit_results:
+        data = [sources[source["filename"]] for source in result["data_sources"]]
         time = result["time"]
         gGF2 = [datum["gGF^2"][0] for datum in data]
         betaGF = [datum["betaGF"][0] for datum in data]
@@ -114,8 +127,8 @@ def plot(fit_results):
 def main():
     args = get_args()
     plt.style.use(args.plot_styles)
-    fit_results = read_all_fit_results(args.fit_filenames)
-    save_or_show(plot(fit_results), args.plot_filename)
+    fit_results = read_all_fit_results(args.fit_filenames, jobs=args.jobs)
+    save_or_show(plot(fit_results, jobs=args.jobs), args.plot_filename)
 
 
 if __name__ == "__main__":
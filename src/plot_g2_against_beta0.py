@@ -4,10 +4,8 @@ import argparse
 
 import matplotlib.pyplot as plt
 
-from plaquette import read_plaquette_from_flows
 from plots import PlotPropRegistry, errorbar_pyerrors, save_or_show
-from read import read_all_fit_results
-from stats import weighted_mean_by_uncertainty
+from read import read_fit_summary
 from utils import group_params
 
 
@@ -33,18 +31,15 @@ def plot(fit_results):
     for (Npv, mpv), param_results in grouped_results.items():
         beta = sorted([datum["beta"] for datum in param_results])
         g_squared = [
-            datum["gGF^2"][0]
-            for datum in sorted(param_results, key=lambda datum: datum["beta"])
-        ]
-        plaquette = [
-            weighted_mean_by_uncertainty(
-                [
-                    read_plaquette_from_flows(source["filename"])
-                    for source in datum["data_sources"]
-                ]
-            )
+            datum["gGF^2[0]"]
             for datum in sorted(param_results, key=lambda datum: datum["beta"])
         ]
+        # Results from flow logs without plaquettes don't record one
+        plaquette_results = sorted(
+            [datum for datum in param_results if "plaquette[0]" in datum],
+            key=lambda datum: datum["beta"],
+        )
+        plaquette = [datum["plaquette[0]"] for datum in plaquette_results]
         errorbar_pyerrors(
             axes[0],
             beta,
@@ -56,7 +51,7 @@ def plot(fit_results):
         )
         errorbar_pyerrors(
             axes[1],
-            beta,
+            [datum["beta"] for datum in plaquette_results],
             plaquette,
             color=colours[(Npv, mpv)],
             dashes=(1, 4),
@@ -71,7 +66,8 @@ def plot(fit_results):
 def main():
     args = get_args()
     plt.style.use(args.plot_styles)
-    fit_results = read_all_fit_results(args.fit_filenames)
+    # Only values and errors are plotted, so the summaries suffice
+    fit_results = [read_fit_summary(filename) for filename in args.fit_filenames]
     save_or_show(plot(fit_results), args.plot_filename)
 
 
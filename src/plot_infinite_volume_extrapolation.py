@@ -41,6 +41,7 @@ def add_finite_L(ax_row, fit_result, colours):
         reader=readers.pop(),
         operator=fit_result["operator"],
         extra_metadata={"Nc": fit_result["Nc"]},
+        times=[time],
     )
     x_values = [1 / flow["NX"] ** 4 for flow in flows]
     gGF2_values = get_scales_at_time(flows, "gGF^2", time)
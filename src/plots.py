@@ -25,20 +25,20 @@ class PlotPropRegistry:
         return cls(prop_cycle.by_key()["color"])
 
 
-def errorbar_pyerrors(ax, x, y, *args, **kwargs):
-    if isinstance(x[0], pe.Obs):
-        x_values = [xi.value for xi in x]
-        x_errors = [xi.dvalue for xi in x]
-    else:
-        x_values = x
-        x_errors = None
+def _values_and_errors(data):
+    # Obs, summary rows as results.load_summary gives them, or plain numbers
+    if len(data) == 0:
+        return data, None
+    if isinstance(data[0], pe.Obs):
+        return [datum.value for datum in data], [datum.dvalue for datum in data]
+    if isinstance(data[0], dict):
+        return [datum["value"] for datum in data], [datum["dvalue"] for datum in data]
+    return data, None
 
-    if isinstance(y[0], pe.Obs):
-        y_values = [yi.value for yi in y]
-        y_errors = [yi.dvalue for yi in y]
-    else:
-        y_values = y
-        y_errors = None
+
+def errorbar_pyerrors(ax, x, y, *args, **kwargs):
+    x_values, x_errors = _values_and_errors(x)
+    y_values, y_errors = _values_and_errors(y)
 
     ax.errorbar(
         x_values,
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import gzip
+
+import numpy as np
+import pyerrors as pe
+from pyerrors.input.json import _od_from_list_and_dict, _parse_json_dict
+import rapidjson as json
+
+
+def _get_idl(configs):
+    # As Obs.__init__ would convert it, but once per replica
+    # rather than once per observable
+    steps = np.unique(np.diff(configs))
+    if len(steps) == 1:
+        return range(configs[0], configs[-1] + steps[0], steps[0])
+    return configs.tolist()
+
+
+def _get_replicas(data):
+    """
+    Read the MC data of an exported structure
+    into a list of (name, idl, deltas) for each replica,
+    with deltas a (configurations x observables) array.
+    """
+    replicas = []
+    for ensemble in data:
+        for replica in ensemble["replica"]:
+            name = replica["name"]
+            if len(name) > len(ensemble["id"]) and name[len(ensemble["id"])] != "|":
+                name = f"{ensemble['id']}|{name[len(ensemble['id']) :]}"
+            deltas = np.asarray(replica["deltas"], dtype=float)
+            configs = deltas[:, 0].astype(int)
+            replicas.append((name, _get_idl(configs), deltas[:, 1:]))
+    return replicas
+
+
+def _get_observables(structure):
+    """
+    Build the Obs of an exported Obs, List or Array from NumPy arrays.
+    Returns None for structures that only pyerrors' own parser handles.
+    """
+    if structure["type"] not in ("Obs", "List", "Array") or structure.get("cdata"):
+        return None
+    if not structure.get("data"):
+        return None
+
+    replicas = _get_replicas(structure["data"])
+    names = [name for name, _, _ in replicas]
+    idl = [idx for _, idx, _ in replicas]
+    # Averaged column by column, as pyerrors does, to reproduce its rounding
+    offsets = [[np.mean(column) for column in deltas.T] for _, _, deltas in replicas]
+    values = structure["value"]
+    tags = structure.get("tag", [None] * len(values))
+    reweighted = structure.get("reweighted", False)
+
+    observables = []
+    for index, value in enumerate(values):
+        obs = pe.Obs(
+            [
+                deltas[:, index] - offset[index]
+                for (_, _, deltas), offset in zip(replicas, offsets)
+            ],
+            names,
+            idl=idl,
+            means=[offset[index] + value for offset in offsets],
+        )
+        obs._value = value
+        obs.reweighted = reweighted
+        obs.tag = tags[index]
+        observables.append(obs)
+
+    if structure["type"] == "Obs":
+        return observables[0]
+    if structure["type"] == "List":
+        return observables
+    layout = [
+        int(size.strip())
+        for size in structure.get("layout", "1").split(",")
+        if len(size) > 0
+    ]
+    return np.reshape(observables, layout)
+
+
+def load_json_dict(filename):
+    """
+    Equivalent to pe.input.json.load_json_dict(filename, full_output=True)
+    without printing, for gzipped files.
+    Obs, lists and arrays of Obs are built from one NumPy array per replica
+    rather than element by element;
+    other structures are passed to pyerrors' own parser.
+    """
+    with gzip.open(filename, "rb") as f:
+        indata = json.loads(f.read())
+
+    obsdata = []
+    for structure in indata["obsdata"]:
+        observables = _get_observables(structure)
+        if observables is None:
+            observables = _parse_json_dict(
+                {"obsdata": [structure]}, verbose=False, full_output=True
+            )["obsdata"][0]
+        obsdata.append(observables)
+
+    description = indata.get("description", "")
+    return {
+        "program": indata.get("program", ""),
+        "version": indata.get("version", ""),
+        "who": indata.get("who", ""),
+        "date": indata.get("date", ""),
+        "host": indata.get("host", ""),
+        "description": description["description"],
+        "obsdata": _od_from_list_and_dict(obsdata, description["OBSDICT"]),
+    }
@@ -1,49 +1,107 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import functools
 import gzip
 import re
 
 from flow_analysis.readers import readers
 
-from joblib import Memory
 import mpmath
 import numpy as np
 import pyerrors as pe
 import rapidjson as json
 
-from utils import partial_corr_mult
+from cache import memory
+from flow_store import StoredFlows, read_stored_flows
+from plaquette import read_plaquette_from_flows
+from results import is_hdf5_results, load_dict, load_summary
+from samples import SampleMatrix, stencils
 
 mpmath.mp.dps = 25
-memory = Memory("cache")
 
 
-def t_times_d_dt(corr, times, time_step, variant="symmetric"):
-    # pyerrors can't cope if you multiply a derivative by a sequence,
-    # as some elements are None
+def t_times_d_dt(samples, times, time_step, variant="symmetric"):
+    d_samples_dt = samples.deriv(variant) / time_step
+    return d_samples_dt.scale(times)
 
-    d_corr_dt = corr.deriv(variant) / time_step
-    return partial_corr_mult(times, d_corr_dt)
 
-
-def normalize_coupling(corr, times, Nc, L):
+def _delta_plus_one_mpmath(time, L):
     # arXiv:1208.1051 Eq. (1.3)
     # Note that the description therein has a typo:
     # theta is the Jacobi theta function, not the Jacobi elliptic function
-    delta_plus_one = [
-        (
-            -64 * time**2 * mpmath.pi**2 / (3 * L**4)
-            + mpmath.jtheta(3, 0, mpmath.exp(-(L**2) / (8 * time))) ** 4
+    return (
+        -64 * time**2 * mpmath.pi**2 / (3 * L**4)
+        + mpmath.jtheta(3, 0, mpmath.exp(-(L**2) / (8 * time))) ** 4
+    )
+
+
+def _theta3_zero(exponent):
+    # Jacobi theta function theta_3(0, q) for q = exp(-exponent).
+    # For exponent < pi, use the modular transformation
+    # theta_3(0, exp(-a)) = sqrt(pi / a) theta_3(0, exp(-pi^2 / a))
+    # so that the series always converges at least as fast as exp(-pi n^2).
+    exponent = np.asarray(exponent, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        reflect = exponent < np.pi
+        series_exponent = np.where(reflect, np.pi**2 / exponent, exponent)
+        n_squared = np.arange(1, 7) ** 2
+        series = 1 + 2 * np.exp(-np.multiply.outer(series_exponent, n_squared)).sum(
+            axis=-1
         )
-        for time in times
-    ]
+        return np.where(reflect, np.sqrt(np.pi / exponent) * series, series)
+
+
+def _delta_plus_one(times, L):
+    # Vectorised equivalent of _delta_plus_one_mpmath
+    times = np.asarray(times, dtype=float)
+    with np.errstate(divide="ignore"):
+        theta = _theta3_zero(L**2 / (8 * times))
+    return -64 * times**2 * np.pi**2 / (3 * L**4) + theta**4
 
+
+def _coupling_coefficients(times, Nc, L):
     # Rearrangement of arXiv:1208.1051 Eq. (1.2)
     # (to give arXiv:2402.18038 Eqs. (2) and (4))
-    coefficient = [
-        128 * mpmath.pi**2 / (element * 3 * (Nc**2 - 1)) for element in delta_plus_one
-    ]
+    return 128 * np.pi**2 / (_delta_plus_one(times, L) * 3 * (Nc**2 - 1))
+
 
-    return partial_corr_mult(np.asarray(coefficient, float), corr)
+def _check_against_mpmath(times, coefficients, Nc, L, rtol=1e-12):
+    nonzero_indices = np.flatnonzero(times)
+    if len(nonzero_indices) == 0:
+        return
+    for index in set(nonzero_indices[[0, len(nonzero_indices) // 2, -1]]):
+        reference = float(
+            128
+            * mpmath.pi**2
+            / (_delta_plus_one_mpmath(times[index], L) * 3 * (Nc**2 - 1))
+        )
+        if not np.isclose(coefficients[index], reference, rtol=rtol, atol=0):
+            raise ValueError(
+                f"Coupling normalisation at t={times[index]} for L={L} "
+                f"disagrees with mpmath: {coefficients[index]} vs {reference}"
+            )
+
+
+@functools.lru_cache
+def coupling_coefficients(L, Nc, h, num_steps):
+    times = h * np.arange(num_steps)
+    coefficients = _coupling_coefficients(times, Nc, L)
+    _check_against_mpmath(times, coefficients, Nc, L)
+    coefficients.setflags(write=False)
+    return coefficients
+
+
+def normalize_coupling(samples, times, Nc, L):
+    times = np.asarray(times, dtype=float)
+    h = times[1] - times[0]
+    if np.allclose(times, h * np.arange(len(times)), rtol=0, atol=1e-9 * h):
+        coefficient = coupling_coefficients(L, Nc, h, len(times))
+    else:
+        coefficient = _coupling_coefficients(times, Nc, L)
+
+    return samples.scale(coefficient)
 
 
 def get_metadata_from_filename(filename):
@@ -55,68 +113,251 @@ def get_metadata_from_filename(filename):
     return {"NT": L, "NX": L, "NY": L, "NZ": L, "Npv": Npv, "mpv": mpv, "beta": beta}
 
 
-@memory.cache
+def is_stored_flows(filename):
+    return filename.endswith(".h5")
+
+
+@memory.cache(keep_last=True)
+def read_text_flows(filename, reader="hp"):
+    return readers[reader](filename)
+
+
 def get_flows(filename, reader="hp", extra_metadata=None):
-    flows = readers[reader](filename)
+    if is_stored_flows(filename):
+        flows = read_stored_flows(filename, reader_name=reader)
+    else:
+        flows = read_text_flows(filename, reader)
     if flows is None:
         return
-    metadata = get_metadata_from_filename(filename)
-    flows.metadata.update(metadata)
-    if extra_metadata is not None:
-        flows.metadata.update(extra_metadata)
+
+    # Don't modify the metadata of the copy held by the cache
+    flows = copy.copy(flows)
+    flows.metadata = {
+        **flows.metadata,
+        **get_metadata_from_filename(filename),
+        **(extra_metadata or {}),
+    }
     return flows
 
 
 @memory.cache
-def get_all_flows(filenames, reader="hp", operator="sym", extra_metadata=None):
-    result = []
-    for filename in filenames:
-        flows = get_flows(filename, reader, extra_metadata)
-        if flows is None:
-            continue
-
-        datum = {
-            **flows.metadata,
-            "filename": flows.filename,
-            "h": flows.h,
-            "t2E": flows.times**2 * flows.get_Es_pyerrors(operator=operator),
-            "reader": flows.reader,
-        }
-        datum["gGF^2"] = normalize_coupling(
-            datum["t2E"], flows.times, datum["Nc"], datum["NX"]
-        )
-        datum["betaGF"] = -t_times_d_dt(
-            datum["gGF^2"], flows.times, flows.h, variant="improved"
-        )
+def get_flow_plaquette(filename):
+    if is_stored_flows(filename):
+        return read_stored_flows(filename).get_plaquette()
+    return read_plaquette_from_flows(filename)
+
+
+def time_index(time, h):
+    return int(time / h)
+
+
+def get_time_indices(times, h, T, variant="improved"):
+    """
+    Indices of the flow time slices needed to compute
+    an observable and its derivative (using variant) at each of times.
+    """
+    width = max(abs(offset) for offset in stencils[variant])
+    indices = set()
+    for time in times:
+        index = time_index(time, h)
+        indices.update(range(max(index - width, 0), min(index + width + 1, T)))
+    return sorted(indices)
+
+
+def get_samples(flows, operator, indices=None):
+    if isinstance(flows, StoredFlows):
+        return flows.get_samples(operator, indices=indices)
+    samples = SampleMatrix.from_corr(flows.get_Es_pyerrors(operator=operator))
+    if indices is None:
+        return samples
+    return samples.select(indices)
+
+
+@memory.cache
+def get_flow_times(filename, reader="hp"):
+    """
+    The flow step and the number of flow time slices in filename,
+    cached apart from the flows so that they can be found without loading them.
+    """
+    flows = get_flows(filename, reader)
+    if flows is None:
+        return
+    return flows.h, len(flows.times)
+
+
+def get_flow_samples(
+    filename, reader="hp", operator="sym", extra_metadata=None, indices=None
+):
+    """
+    Read the flow of one ensemble, returning its metadata,
+    and the samples of E for operator as "E",
+    at only the time slices in indices if it is given.
+    Text files are parsed once, by the cached read_text_flows,
+    whichever slices are asked for;
+    for HDF5 files, only those slices are read from disk.
+    """
+    flows = get_flows(filename, reader, extra_metadata)
+    if flows is None:
+        return
+
+    return {
+        **flows.metadata,
+        "filename": flows.filename,
+        "h": flows.h,
+        "times": flows.times,
+        "E": get_samples(flows, operator, indices=indices),
+        "reader": flows.reader,
+        # Read while the file is being ingested anyway,
+        # so that later stages don't need to return to the raw data;
+        # None if the log doesn't record the configurations' plaquettes
+        "plaquette": get_flow_plaquette(filename),
+    }
+
+
+@memory.cache
+def get_derived_flows(
+    filename, reader="hp", operator="sym", extra_metadata=None, indices=None
+):
+    """
+    Compute t^2 E, the coupling, and the beta function
+    from the flow of one ensemble, at the time slices in indices if given,
+    and perform their error analysis,
+    so that both are kept in the cache for each selection of slices.
+    """
+    datum = get_flow_samples(filename, reader, operator, extra_metadata, indices)
+    if datum is None:
+        return
+
+    flow_times = datum.pop("times")
+    samples = datum.pop("E")
+
+    datum["t2E"] = samples.scale(flow_times**2)
+    datum["gGF^2"] = normalize_coupling(
+        datum["t2E"], flow_times, datum["Nc"], datum["NX"]
+    )
+    datum["betaGF"] = -t_times_d_dt(
+        datum["gGF^2"], flow_times, datum["h"], variant="improved"
+    )
+    for key in ["t2E", "gGF^2", "betaGF"]:
+        datum[key].gamma_method()
+    return datum
+
+
+def get_single_flows(
+    filename, reader="hp", operator="sym", extra_metadata=None, times=None
+):
+    """
+    Read the flow of one ensemble and compute t^2 E, the coupling,
+    and the beta function from it.
+    If times is given, only the time slices needed to evaluate these
+    at those flow times are loaded and computed.
+    """
+    indices = None
+    if times is not None:
+        flow_times = get_flow_times(filename, reader)
+        if flow_times is None:
+            return
+        indices = get_time_indices(times, *flow_times)
+
+    return get_derived_flows(filename, reader, operator, extra_metadata, indices)
 
-        for key in "t2E", "gGF^2", "betaGF":
-            datum[key].gamma_method()
 
-        result.append(datum)
+def get_all_flows_by_operator(
+    filenames, reader="hp", operators=("sym",), extra_metadata=None, times=None
+):
+    # Loop over operators innermost, so that each file is parsed
+    # (or loaded from the cache) once for all operators
+    if times is not None:
+        times = sorted(times)
+    result = {operator: [] for operator in operators}
+    for filename in filenames:
+        for operator in operators:
+            datum = get_single_flows(filename, reader, operator, extra_metadata, times)
+            if datum is not None:
+                result[operator].append(datum)
     return result
 
 
-def recurse_gamma(obj):
+def get_all_flows(
+    filenames, reader="hp", operator="sym", extra_metadata=None, times=None
+):
+    return get_all_flows_by_operator(
+        filenames,
+        reader=reader,
+        operators=[operator],
+        extra_metadata=extra_metadata,
+        times=times,
+    )[operator]
+
+
+class LazyObs(pe.Obs):
+    """
+    An Obs whose error analysis is deferred until its uncertainty is needed.
+    The first read of dvalue or ddvalue, including when printing,
+    runs gamma_method() with default arguments;
+    the result is kept, as it would be for a plain Obs.
+    Calling gamma_method() explicitly, e.g. with other arguments,
+    behaves as for any Obs.
+    """
+
+    __slots__ = ()
+
+    def _ensure_analysed(self):
+        try:
+            pe.Obs.e_dvalue.__get__(self)
+        except AttributeError:
+            self.gamma_method()
+
+    @property
+    def _dvalue(self):
+        self._ensure_analysed()
+        return pe.Obs._dvalue.__get__(self)
+
+    @_dvalue.setter
+    def _dvalue(self, value):
+        pe.Obs._dvalue.__set__(self, value)
+
+    @property
+    def ddvalue(self):
+        self._ensure_analysed()
+        return pe.Obs.ddvalue.__get__(self)
+
+    @ddvalue.setter
+    def ddvalue(self, value):
+        pe.Obs.ddvalue.__set__(self, value)
+
+
+def recurse_lazy(obj):
+    """
+    Make each Obs in the nested containers obj defer its error analysis.
+    """
     if isinstance(obj, dict):
-        recurse_gamma(obj.values())
+        recurse_lazy(obj.values())
         return
     if isinstance(obj, str):
         raise TypeError("Can't recurse into a string.")
+    if isinstance(obj, pe.Obs):
+        if type(obj) is pe.Obs:
+            obj.__class__ = LazyObs
+        return
     try:
         for value in obj:
-            recurse_gamma(value)
+            recurse_lazy(value)
     except TypeError:
-        obj.gamma_method()
+        pass
 
 
 def read_fit_result(filename, pyerrors=True):
     if pyerrors:
-        data = pe.input.json.load_json_dict(filename, verbose=False, full_output=True)
+        data = load_dict(filename)
+    elif is_hdf5_results(filename):
+        raise ValueError(f"{filename} can only be read with pyerrors")
     else:
         with gzip.open(filename, "r") as f:
             data = json.load(f)
     data["filename"] = filename
-    recurse_gamma(data["obsdata"])
+    # Errors are only computed for the observables that are used
+    recurse_lazy(data["obsdata"])
     data.update(data.pop("description"))
     data.update(data.pop("obsdata"))
     if not pyerrors:
@@ -125,5 +366,34 @@ def read_fit_result(filename, pyerrors=True):
     return data
 
 
-def read_all_fit_results(filenames, pyerrors=True):
-    return [read_fit_result(filename, pyerrors=pyerrors) for filename in filenames]
+def read_fit_summary(filename):
+    """
+    Read the description of the results in filename,
+    and the summary row of each Obs they contain
+    keyed by its name in the summary, e.g. "gGF^2[0]",
+    without loading the Monte Carlo histories.
+    """
+    summary = load_summary(filename)
+    return {
+        "filename": filename,
+        **summary["description"],
+        **{row["name"]: row for row in summary["observables"]},
+    }
+
+
+def read_all_fit_results(filenames, pyerrors=True, jobs=1):
+    """
+    Read each of filenames with read_fit_result,
+    decompressing and decoding on jobs processes.
+    """
+    if jobs == 1 or len(filenames) <= 1:
+        return [read_fit_result(filename, pyerrors=pyerrors) for filename in filenames]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(
+            executor.map(
+                functools.partial(read_fit_result, pyerrors=pyerrors),
+                filenames,
+                chunksize=max(1, len(filenames) // (4 * jobs)),
+            )
+        )
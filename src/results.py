@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import json
+
+import h5py
+import numpy as np
+import pyerrors as pe
+from pyerrors.input.json import _od_from_list_and_dict, _ol_from_dict
+
+from cache import file_identity
+from catalogue import register_result
+from flow_store import _to_json
+from pyerrors_json import load_json_dict
+
+format_version = 1
+
+
+def is_hdf5_results(filename):
+    return filename.endswith(".h5")
+
+
+def summary_filename(filename):
+    return f"{filename}.summary.json"
+
+
+def _summary_row(name, obs):
+    if not hasattr(obs, "e_dvalue"):
+        obs.gamma_method()
+    return {
+        "name": name,
+        "value": float(obs.value),
+        "dvalue": float(obs.dvalue),
+        "ddvalue": float(obs.ddvalue),
+        "tauint": {e_name: float(tauint) for e_name, tauint in obs.e_tauint.items()},
+    }
+
+
+def _summarise(obj, name, rows):
+    """
+    Append a summary row to rows for each Obs in the nested structure obj,
+    named by its path within obj.
+    """
+    if isinstance(obj, pe.Obs):
+        rows.append(_summary_row(name, obj))
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            _summarise(value, f"{name}.{key}" if name else key, rows)
+    elif isinstance(obj, pe.Corr):
+        _summarise(obj.content, name, rows)
+    elif isinstance(obj, np.ndarray) and obj.dtype == object:
+        for index in np.ndindex(obj.shape):
+            _summarise(obj[index], f"{name}[{','.join(map(str, index))}]", rows)
+    elif isinstance(obj, (list, tuple)):
+        for index, value in enumerate(obj):
+            _summarise(value, f"{name}[{index}]", rows)
+
+
+def _write_summary(obsdata, filename, description):
+    """
+    Write the value, error and tau_int of each Obs in obsdata,
+    with the description, next to the full results in filename,
+    and return them.
+    """
+    rows = []
+    _summarise(obsdata, "", rows)
+    summary = {
+        # Lets readers tell if the results were rewritten without the summary
+        "results_identity": file_identity(filename),
+        "description": description,
+        "observables": rows,
+    }
+    with open(summary_filename(filename), "w") as f:
+        json.dump(summary, f, default=_to_json)
+    return rows
+
+
+def _get_structure(structure):
+    """
+    Return the type, layout and flattened list of Obs of an exported structure.
+    """
+    if isinstance(structure, pe.Obs):
+        return "Obs", (), [structure]
+    if isinstance(structure, np.ndarray):
+        return "Array", structure.shape, list(structure.ravel())
+    if isinstance(structure, list) and all(
+        isinstance(obs, pe.Obs) for obs in structure
+    ):
+        return "List", (len(structure),), structure
+    raise TypeError(
+        f"Can't store {type(structure).__name__} in HDF5 results; use .json.gz"
+    )
+
+
+def _write_structure(group, structure):
+    structure_type, layout, observables = _get_structure(structure)
+    template = observables[0]
+    for obs in observables:
+        if obs.cov_names:
+            raise TypeError("Can't store Obs with covobs in HDF5 results")
+        if obs.names != template.names or any(
+            obs.idl[name] != template.idl[name] for name in template.names
+        ):
+            raise ValueError(
+                "All Obs in a structure must be defined on the same configurations"
+            )
+
+    group.attrs["type"] = structure_type
+    group.attrs["layout"] = layout
+    group.attrs["tags"] = json.dumps([obs.tag for obs in observables])
+    group.attrs["reweighted"] = template.reweighted
+    group.create_dataset("value", data=[obs.value for obs in observables])
+    for index, name in enumerate(template.names):
+        replica = group.create_group(f"replicas/{index}")
+        replica.attrs["name"] = name
+        idl = template.idl[name]
+        if isinstance(idl, range):
+            replica.attrs["idl_range"] = (idl.start, idl.stop, idl.step)
+        else:
+            replica.create_dataset("configs", data=idl)
+        replica.create_dataset(
+            "deltas",
+            data=np.column_stack([obs.deltas[name] for obs in observables]),
+            compression="gzip",
+            shuffle=True,
+        )
+        replica.create_dataset(
+            "r_values", data=[obs.r_values[name] for obs in observables]
+        )
+
+
+def _read_structure(group):
+    names = []
+    idl = []
+    deltas = []
+    r_values = []
+    for replica in group["replicas"].values():
+        names.append(str(replica.attrs["name"]))
+        if "idl_range" in replica.attrs:
+            idl.append(range(*(int(bound) for bound in replica.attrs["idl_range"])))
+        else:
+            idl.append(replica["configs"][()].tolist())
+        deltas.append(replica["deltas"][()])
+        r_values.append(replica["r_values"][()])
+
+    tags = json.loads(group.attrs["tags"])
+    observables = []
+    for index, value in enumerate(group["value"][()]):
+        obs = pe.Obs(
+            [replica_deltas[:, index] for replica_deltas in deltas],
+            names,
+            idl=idl,
+            means=[replica_r_values[index] for replica_r_values in r_values],
+        )
+        obs._value = float(value)
+        obs.reweighted = bool(group.attrs["reweighted"])
+        obs.tag = tags[index]
+        observables.append(obs)
+
+    structure_type = group.attrs["type"]
+    if structure_type == "Obs":
+        return observables[0]
+    if structure_type == "List":
+        return observables
+    return np.reshape(observables, tuple(group.attrs["layout"]))
+
+
+def _dump_hdf5(ol, filename, description, obsdict=None):
+    with h5py.File(filename, "w") as f:
+        f.attrs["format_version"] = format_version
+        f.attrs["description"] = json.dumps(description, default=_to_json)
+        if obsdict is not None:
+            f.attrs["obsdict"] = json.dumps(obsdict)
+        for index, structure in enumerate(ol):
+            _write_structure(f.create_group(f"obsdata/{index}"), structure)
+
+
+def _load_hdf5(filename):
+    with h5py.File(filename, "r") as f:
+        if f.attrs["format_version"] != format_version:
+            raise ValueError(
+                f"{filename} has format version {f.attrs['format_version']}; "
+                f"expected {format_version}"
+            )
+        ol = [
+            _read_structure(f["obsdata"][str(index)])
+            for index in range(len(f["obsdata"]))
+        ]
+        obsdict = json.loads(f.attrs["obsdict"]) if "obsdict" in f.attrs else None
+        return ol, obsdict, json.loads(f.attrs["description"])
+
+
+def dump_dict(od, filename, description=""):
+    """
+    Write the dict of Obs and structures of Obs od to filename,
+    as HDF5 if filename ends in .h5,
+    and otherwise as pe.input.json.dump_dict_to_json does,
+    along with a summary for load_summary,
+    and records it in the catalogue if one is configured.
+    """
+    if is_hdf5_results(filename):
+        ol, obsdict = _ol_from_dict(od)
+        _dump_hdf5(ol, filename, description, obsdict=obsdict)
+    else:
+        pe.input.json.dump_dict_to_json(od, filename, description=description)
+    rows = _write_summary(od, filename, description)
+    register_result(filename, description, rows)
+
+
+def dump_obs(obs, filename, description=""):
+    """
+    Write the single Obs obs to filename,
+    as HDF5 if filename ends in .h5,
+    and otherwise as Obs.dump does,
+    along with a summary for load_summary,
+    and records it in the catalogue if one is configured.
+    """
+    if is_hdf5_results(filename):
+        _dump_hdf5([obs], filename, description)
+    else:
+        obs.dump(filename, description=description)
+    rows = _write_summary([obs], filename, description)
+    register_result(filename, description, rows)
+
+
+def load_dict(filename):
+    """
+    Read a file written by dump_dict, in either format, returning a dict
+    with the description and the reconstructed dict of Obs as obsdata,
+    as pe.input.json.load_json_dict(full_output=True) does.
+    """
+    if not is_hdf5_results(filename):
+        return load_json_dict(filename)
+
+    ol, obsdict, description = _load_hdf5(filename)
+    return {"description": description, "obsdata": _od_from_list_and_dict(ol, obsdict)}
+
+
+def load_list(filename):
+    """
+    Read a file written by dump_obs, in either format, returning a dict
+    with the description and a list of the Obs as obsdata,
+    as pe.input.json.load_json(full_output=True) does.
+    """
+    if not is_hdf5_results(filename):
+        return pe.input.json.load_json(filename, full_output=True, verbose=False)
+
+    ol, _, description = _load_hdf5(filename)
+    return {"description": description, "obsdata": ol}
+
+
+def load_summary(filename):
+    """
+    Read the description of the results in filename,
+    and the value, error and tau_int of each Obs they contain,
+    without loading the Monte Carlo histories.
+    Falls back to loading the full results
+    if there is no up-to-date summary alongside them.
+    """
+    try:
+        with open(summary_filename(filename)) as f:
+            summary = json.load(f)
+    except FileNotFoundError:
+        summary = None
+    if summary is not None and summary["results_identity"] == file_identity(filename):
+        return {
+            "description": summary["description"],
+            "observables": summary["observables"],
+        }
+
+    if is_hdf5_results(filename):
+        ol, obsdict, description = _load_hdf5(filename)
+        obsdata = ol if obsdict is None else _od_from_list_and_dict(ol, obsdict)
+    else:
+        data = pe.input.json.load_json(filename, full_output=True, verbose=False)
+        description = data["description"]
+        obsdata = data["obsdata"]
+        if isinstance(description, dict) and "OBSDICT" in description:
+            # Written by dump_dict
+            obsdata = _od_from_list_and_dict(obsdata, description["OBSDICT"])
+            description = description["description"]
+    rows = []
+    _summarise(obsdata, "", rows)
+    return {"description": description, "observables": rows}
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pyerrors as pe
+
+from gamma import gamma_method
+
+
+# Finite difference stencils as {offset: weight}, matching pe.Corr.deriv
+stencils = {
+    "symmetric": {-1: -0.5, 1: 0.5},
+    "forward": {0: -1.0, 1: 1.0},
+    "backward": {-1: -1.0, 0: 1.0},
+    "improved": {-2: 1 / 12, -1: -8 / 12, 1: 8 / 12, 2: -1 / 12},
+}
+
+
+class SampleMatrix:
+    """
+    Monte Carlo history of a time-dependent observable, held as one
+    dense (configurations x times) array per replica.
+
+    Only the time slices listed in `indices` are stored;
+    any other slice in range(T) is treated as None, as in a padded pe.Corr.
+    Linear operations act on whole arrays;
+    pe.Obs objects are only built for slices that are indexed.
+    """
+
+    def __init__(self, samples, idl, T, indices=None):
+        self.names = sorted(samples)
+        self.samples = {
+            name: np.asarray(samples[name], dtype=float) for name in samples
+        }
+        self.idl = dict(idl)
+        self.T = T
+        if indices is None:
+            indices = np.arange(T)
+        self.indices = np.asarray(indices, dtype=int)
+        self._columns = {index: column for column, index in enumerate(self.indices)}
+        self._obs = {}
+
+        for name, sample in self.samples.items():
+            if sample.shape != (len(self.idl[name]), len(self.indices)):
+                raise ValueError(
+                    f"Samples for {name} have shape {sample.shape}; expected "
+                    f"{(len(self.idl[name]), len(self.indices))}"
+                )
+
+    @classmethod
+    def from_corr(cls, corr):
+        if corr.N != 1:
+            raise ValueError("Only one-dimensional correlators can be converted.")
+
+        content = [corr[index] for index in range(corr.T)]
+        indices = [index for index, obs in enumerate(content) if obs is not None]
+        if not indices:
+            raise ValueError("Correlator has no non-None time slices.")
+
+        template = content[indices[0]]
+        samples = {
+            name: np.column_stack(
+                [
+                    content[index].deltas[name] + content[index].r_values[name]
+                    for index in indices
+                ]
+            )
+            for name in template.names
+        }
+        return cls(samples, template.idl, corr.T, indices=indices)
+
+    def __len__(self):
+        return self.T
+
+    def _derived(self, samples, indices=None):
+        return type(self)(
+            samples,
+            self.idl,
+            self.T,
+            indices=self.indices if indices is None else indices,
+        )
+
+    def select(self, indices):
+        """
+        Keep only the time slices in `indices`, all of which must be held.
+        """
+        columns = [self._columns[index] for index in indices]
+        return self._derived(
+            {name: sample[:, columns] for name, sample in self.samples.items()},
+            indices=indices,
+        )
+
+    def scale(self, coefficients):
+        """
+        Multiply each time slice by the matching element of `coefficients`,
+        which is indexed by time slice and has length T.
+        """
+        coefficients = np.asarray(coefficients, dtype=float)[self.indices]
+        return self._derived(
+            {name: sample * coefficients for name, sample in self.samples.items()}
+        )
+
+    def __mul__(self, other):
+        if not np.isscalar(other):
+            return NotImplemented
+        return self._derived(
+            {name: sample * other for name, sample in self.samples.items()}
+        )
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if not np.isscalar(other):
+            return NotImplemented
+        return self * (1 / other)
+
+    def __neg__(self):
+        return self * -1
+
+    def deriv(self, variant="symmetric"):
+        """
+        Finite difference derivative with respect to the time index,
+        defined on the same slices and with the same stencils as pe.Corr.deriv.
+        """
+        stencil = stencils[variant]
+        new_indices = [
+            index
+            for index in self.indices
+            if all(index + offset in self._columns for offset in stencil)
+        ]
+        if not new_indices:
+            raise ValueError("Derivative is undefined at all timeslices")
+
+        new_samples = {}
+        for name, sample in self.samples.items():
+            new_samples[name] = sum(
+                weight
+                * sample[:, [self._columns[index + offset] for index in new_indices]]
+                for offset, weight in stencil.items()
+            )
+        return self._derived(new_samples, indices=new_indices)
+
+    def _build_obs(self, index):
+        column = self._columns[index]
+        return pe.Obs(
+            [self.samples[name][:, column] for name in self.names],
+            self.names,
+            idl=[self.idl[name] for name in self.names],
+        )
+
+    def gamma_method(self, indices=None):
+        """
+        Build the pe.Obs for the time slices in `indices` (default all held)
+        and perform their error analysis together.
+        """
+        if indices is None:
+            indices = self.indices
+        indices = [
+            index
+            for index in indices
+            if index in self._columns and index not in self._obs
+        ]
+        observables = [self._build_obs(index) for index in indices]
+        gamma_method(observables)
+        self._obs.update(zip(indices, observables))
+
+    def get_obs(self, index):
+        """
+        Return the pe.Obs for time slice `index` (or None if it is not held),
+        with its error analysis already performed.
+        """
+        if index < 0:
+            index += self.T
+        if not 0 <= index < self.T:
+            raise IndexError(f"Index {index} out of range for T={self.T}")
+        if index not in self._columns:
+            return None
+
+        if index not in self._obs:
+            self.gamma_method([index])
+        return self._obs[index]
+
+    def __getitem__(self, index):
+        return self.get_obs(index)
+
+    def to_corr(self):
+        self.gamma_method()
+        return pe.Corr([self.get_obs(index) for index in range(self.T)])
@@ -2,12 +2,24 @@
 
 import numpy as np
 
+from linear_fits import linear_combination
+
+
+def aic_weights(aic):
+    # Shifting by the minimum leaves the normalised weights unchanged,
+    # but avoids underflow when all AICs are large
+    aic = np.asarray(aic, dtype=float)
+    return np.exp(-(aic - np.nanmin(aic)))
+
 
 def weighted_mean(results):
-    values = np.asarray([result.fit_parameters for result, aic in results])
-    weights = np.asarray([np.exp(-aic) for result, aic in results])
+    coefficients = results.weighted_coefficients(aic_weights(results.aic))
+    used = np.flatnonzero(np.any(coefficients != 0, axis=0))
+    result = [
+        linear_combination([results.y_values[index] for index in used], row[used])
+        for row in coefficients
+    ]
 
-    result = list((values * weights[:, np.newaxis]).sum(axis=0) / weights.sum())
     for value in result:
         value.gamma_method()
 
@@ -40,15 +40,94 @@ def partial_corr_mult(array, partial_corr):
     )
 
 
+def index_combinations(max_count, min_count=1):
+    valid_indices = list(range(0, max_count))
+    for count in range(min_count, max_count + 1):
+        yield from itertools.combinations(valid_indices, count)
+
+
+def all_subsets(keys, min_count=1):
+    return list(index_combinations(len(keys), min_count=min_count))
+
+
+def _argsort(keys):
+    return sorted(range(len(keys)), key=lambda index: keys[index])
+
+
+def contiguous_subsets(keys, min_count=1):
+    # All windows of consecutive points, once sorted by key;
+    # O(n^2) subsets for n points
+    order = _argsort(keys)
+    return [
+        tuple(sorted(order[start : start + count]))
+        for count in range(min_count, len(keys) + 1)
+        for start in range(len(keys) - count + 1)
+    ]
+
+
+def drop_smallest_subsets(keys, min_count=1, max_dropped=None):
+    # All points, then all but the smallest, all but the two smallest, etc.;
+    # at most max_dropped + 1 subsets
+    order = _argsort(keys)
+    if max_dropped is None:
+        max_dropped = len(keys)
+    return [
+        tuple(sorted(order[num_dropped:]))
+        for num_dropped in range(min(max_dropped, len(keys) - min_count) + 1)
+    ]
+
+
+subset_strategies = {
+    "all": all_subsets,
+    "contiguous": contiguous_subsets,
+    "drop_smallest": drop_smallest_subsets,
+}
+
+
+def cap_subsets(subsets, keys, max_count):
+    # Prefer subsets with more points, then those with larger keys
+    def preference(subset):
+        return len(subset), sorted([keys[index] for index in subset], reverse=True)
+
+    return sorted(subsets, key=preference, reverse=True)[:max_count]
+
+
+def largest_subsets(keys, min_count=1, max_count=None):
+    # As cap_subsets(all_subsets(keys, min_count), keys, max_count),
+    # but generating subsets lazily in order of preference,
+    # so only the max_count kept are ever built
+    groups = [
+        [index for index, key in enumerate(keys) if key == value]
+        for value in sorted(set(keys), reverse=True)
+    ]
+
+    def group_counts(total, groups):
+        # How many indices to take from each group, taking most from the first
+        if total > sum(map(len, groups)):
+            return
+        if not groups:
+            yield ()
+            return
+        for count in range(min(total, len(groups[0])), -1, -1):
+            for rest in group_counts(total - count, groups[1:]):
+                yield (count, *rest)
+
+    candidates = (
+        tuple(sorted(itertools.chain.from_iterable(choice)))
+        for size in range(len(keys), min_count - 1, -1)
+        for counts in group_counts(size, groups)
+        for choice in itertools.product(*map(itertools.combinations, groups, counts))
+    )
+    return list(itertools.islice(candidates, max_count))
+
+
 def zip_combinations(*lists, min_count=1):
     max_count = min([len(list_) for list_ in lists])
     if max_count != max([len(list_) for list_ in lists]):
         logging.warning("List lengths are not equal.")
 
-    valid_indices = list(range(0, max_count))
-    for count in range(min_count, max_count + 1):
-        for selected_indices in itertools.combinations(valid_indices, count):
-            yield [[list_[index] for index in selected_indices] for list_ in lists]
+    for selected_indices in index_combinations(max_count, min_count=min_count):
+        yield [[list_[index] for index in selected_indices] for list_ in lists]
 
 
 class SplitArgs(argparse.Action):
@@ -60,12 +139,8 @@ class SplitArgs(argparse.Action):
 
 
 def group_params(fit_results, keys):
-    params = sorted(set(tuple(result[key] for key in keys) for result in fit_results))
-    return {
-        param_set: [
-            result
-            for result in fit_results
-            if all([result[key] == param for key, param in zip(keys, param_set)])
-        ]
-        for param_set in params
-    }
+    # One pass over fit_results, rather than one per parameter set
+    groups = {}
+    for result in fit_results:
+        groups.setdefault(tuple(result[key] for key in keys), []).append(result)
+    return {param_set: groups[param_set] for param_set in sorted(groups)}
@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pyerrors as pe
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import gamma  # noqa: E402
+
+
+def ar1(rng, length, rho, mean):
+    values = np.empty(length)
+    values[0] = rng.normal()
+    for index in range(1, length):
+        values[index] = rho * values[index - 1] + rng.normal()
+    return mean + values
+
+
+def irregular_configs(rng, length):
+    # Sorted, with gaps of varying size
+    return sorted(rng.choice(np.arange(1, 3 * length), size=length, replace=False))
+
+
+@pytest.mark.parametrize(
+    "get_idl",
+    [
+        lambda rng, length: range(1, length + 1),
+        lambda rng, length: range(4, 4 * length + 4, 4),
+        irregular_configs,
+    ],
+    ids=["regular", "gapped", "irregular"],
+)
+def test_gamma_method_matches_pyerrors(get_idl):
+    rng = np.random.default_rng(1234)
+    names = ["ensemble|r0", "ensemble|r1", "ensemble|r2"]
+    lengths = [500, 320, 410]
+    idl = [get_idl(rng, length) for length in lengths]
+    samples = [
+        [ar1(rng, length, rho, 1 + rho) for length in lengths]
+        for rho in [0.0, 0.5, 0.8, 0.95]
+    ]
+
+    def build():
+        return [pe.Obs(replicas, names, idl=idl) for replicas in samples]
+
+    batched = build()
+    gamma.gamma_method(batched)
+    reference = build()
+    for obs in reference:
+        obs.gamma_method()
+
+    for obs, expected in zip(batched, reference):
+        assert obs.dvalue == pytest.approx(expected.dvalue, rel=1e-10, abs=0)
+        assert obs.ddvalue == pytest.approx(expected.ddvalue, rel=1e-10, abs=0)
+        for e_name in expected.mc_names:
+            assert obs.e_windowsize[e_name] == expected.e_windowsize[e_name]
+            assert obs.e_tauint[e_name] == pytest.approx(
+                expected.e_tauint[e_name], rel=1e-10, abs=0
+            )
+            assert obs.e_dtauint[e_name] == pytest.approx(
+                expected.e_dtauint[e_name], rel=1e-10, abs=0
+            )
+            assert obs.e_dvalue[e_name] == pytest.approx(
+                expected.e_dvalue[e_name], rel=1e-10, abs=0
+            )
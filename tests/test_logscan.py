@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import phasediagram  # noqa: E402
+from cache import Cache  # noqa: E402
+from phasediagram import hmc_log_scanner, parse_hmc_log  # noqa: E402
+
+
+def write_hmc_log(path, num_trajectories, trailing_newline=True):
+    lines = [b"[MD_INT][10]MD parameters: level=0 tlen=1.000000 nsteps=10"]
+    for trajectory in range(1, num_trajectories + 1):
+        lines += [
+            b"[MAIN][0]Trajectory #%d..." % trajectory,
+            b"[HMC][10]Configuration accepted. [deltaH = 0.1]",
+            b"[MAIN][0]Plaquette: %.16f" % (trajectory / 1000),
+        ]
+    path.write_bytes(b"\n".join(lines) + (b"\n" if trailing_newline else b""))
+
+
+def test_scan_reads_final_line_without_newline(tmp_path):
+    path = tmp_path / "out_hmc"
+    write_hmc_log(path, 200, trailing_newline=False)
+
+    records, end = hmc_log_scanner.scan(path)
+    assert len(records["plaquette"]["plaquette"]) == 200
+    assert end == path.stat().st_size
+
+    records, end = hmc_log_scanner.scan(path, resumable=True)
+    assert len(records["plaquette"]["plaquette"]) == 199
+    assert path.read_bytes()[end:] == b"[MAIN][0]Plaquette: 0.2000000000000000"
+
+
+def test_parse_hmc_log_without_trailing_newline(tmp_path, monkeypatch):
+    monkeypatch.setattr(phasediagram, "memory", Cache(location=tmp_path / "cache"))
+    path = tmp_path / "out_hmc"
+    write_hmc_log(path, 200, trailing_newline=False)
+
+    state = parse_hmc_log(path)
+    assert len(state["plaquettes"]) == 200
+    assert np.array_equal(state["trajectories"], np.arange(1, 201))
+
+    # Once the final line is complete and more are written,
+    # it is counted once
+    with open(path, "ab") as f:
+        f.write(b"\n[MAIN][0]Trajectory #201...\n[MAIN][0]Plaquette: 0.201\n")
+    state = parse_hmc_log(path)
+    assert len(state["plaquettes"]) == 201
+    assert np.array_equal(state["trajectories"], np.arange(1, 202))